@@ -3,6 +3,9 @@ from .evidence import observe  # noqa: 401
 
 # need to use this to import layer_registry code, and made it usable from prob_model without import explicit by from ...
 from . import layer_registry  # noqa: 401
+from . import parameter_reuse  # noqa: 401
+from . import local_parameters  # noqa: 401
+from . import shared_variables  # noqa: 401
 
 
 __all__ = [
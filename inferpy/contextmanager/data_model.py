@@ -1,3 +1,4 @@
+import tensorflow as tf
 from contextlib import contextmanager, ExitStack
 from . import randvar_registry
 
@@ -27,7 +28,8 @@ def get_sample_shape(name):
     This function must be used inside a datamodel context (it is not checked here)
     If the parameters are not already expanded, then are now expanded.
         :name (str): The name of the variable to get its sample shape
-        :returns: the sample_shape (number of samples of the datamodel). It is an integer, or ().
+        :returns: the sample_shape (number of samples of the datamodel). It is an integer, a scalar integer tensor
+            (if the size is dynamic), or ().
     """
 
     # Parameters already expanded? (remember that in probmodel definitions, each RandomVariable must have a name)
@@ -41,13 +43,18 @@ def get_sample_shape(name):
     return size
 
 
+def is_dynamic(size):
+    # a dynamic size is a scalar integer tensor (or tf.Variable) whose value is only known when running the graph
+    return isinstance(size, (tf.Tensor, tf.Variable))
+
+
 @contextmanager
 def fit(size):
-    # size must be an integer
-    if not isinstance(size, int):
-        raise TypeError('The size of the data model must be an integer, not : {}'.format(type(size)))
-    # Fit the datamodel parameters
-    _active_datamodel['size'] = size
+    # size must be an integer, or a scalar integer tensor to use a dynamic size
+    if not isinstance(size, int) and not is_dynamic(size):
+        raise TypeError('The size of the data model must be an integer or a tensor, not : {}'.format(type(size)))
+    # Fit the datamodel parameters. A dynamic size is used as a tensor (i.e. reading the value of a tf.Variable)
+    _active_datamodel['size'] = tf.convert_to_tensor(size) if is_dynamic(size) else size
 
     try:
         yield
@@ -16,8 +16,11 @@ def observe(variables, data):
         # Now load the value into the `tf.Variable`:
         # if has shape attr:
         if hasattr(v, 'shape'):
+            # the shape of the tf.Variable is not fixed (i.e. dynamic datamodel size), so the value is loaded as it is
+            if not variables[k].observed_value.shape.is_fully_defined():
+                variables[k].observed_value.load(v, session=sess)
             # shape of tf.Variable and value matches
-            if v.shape == variables[k].observed_value.shape:
+            elif v.shape == variables[k].observed_value.shape:
                 variables[k].observed_value.load(v, session=sess)
             # shape of tf.Variable and value without the sample_shape (first dim) matches
             # NOTE: this might happend if data comes from sample() and sample_shape == 1
@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+
+
+"""This context is used to build the Parameters inside a datamodel as tables with a row for each instance of the full
+data, instead of a row for each instance of the datamodel plate. The value of these Parameters is the set of rows of
+the instances being processed (i.e. the current batch), so only these rows are used and updated.
+"""
+
+
+_properties = dict(
+    indices=None,
+    size=None
+)
+
+
+def is_active():
+    return _properties['indices'] is not None
+
+
+def get_indices():
+    # the rows of the tables used as the value of the Parameters
+    return _properties['indices']
+
+
+def get_size():
+    # the number of rows of the tables
+    return _properties['size']
+
+
+@contextmanager
+def gather(indices, size):
+    """
+    Parameters built inside a datamodel in this context use a tf.Variable with `size` rows, and the rows in
+    `indices` (an integer tensor) are their value.
+    """
+    # NOTE: We only allow to use one context level
+    assert not is_active()
+    _properties['indices'] = indices
+    _properties['size'] = size
+    try:
+        yield
+    finally:
+        _properties['indices'] = None
+        _properties['size'] = None
@@ -0,0 +1,38 @@
+from contextlib import contextmanager
+
+
+"""This context is used to build Parameters using tf.Variables which already exist, instead of creating new ones.
+The tf.Variables are matched by the name of the Parameter. It allows to build a model again (i.e. inside a
+tf.while_loop, where new variables cannot be created) sharing the variables of a previous expansion.
+"""
+
+
+_properties = dict(
+    variables=None
+)
+
+
+def is_active():
+    return _properties['variables'] is not None
+
+
+def get_variable(name):
+    # return the tf.Variable to reuse for the parameter called `name` if exists. Otherwise, return None
+    if not is_active():
+        return None
+    return _properties['variables'].get(name, None)
+
+
+@contextmanager
+def reuse(variables):
+    """
+    Parameters built inside this context use the tf.Variable in `variables` (a dict name: tf.Variable)
+    whose key matches their name.
+    """
+    # NOTE: We only allow to use one context level
+    assert not is_active()
+    _properties['variables'] = variables
+    try:
+        yield
+    finally:
+        _properties['variables'] = None
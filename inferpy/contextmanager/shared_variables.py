@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+import tensorflow as tf
+
+
+"""These contexts are used to build a model several times sharing all its tf.Variables (parameters, variables used
+to observe random variables, layer weights, ...). The variables created while building the model inside `record`
+are stored in creation order. Then, building the same model inside `share` returns the recorded variables in the
+same order, instead of creating new ones. The shared variables are already initialized, so they must not be
+initialized again (see `is_shared`).
+"""
+
+
+# the lists of tf.Variables returned by the active share contexts
+_shared = []
+
+
+@contextmanager
+def record():
+    """ Yields the list where the tf.Variables created in this context are stored in creation order """
+    variables = []
+
+    def creator(next_creator, **kwargs):
+        v = next_creator(**kwargs)
+        variables.append(v)
+        return v
+
+    with tf.variable_creator_scope(creator):
+        yield variables
+
+
+@contextmanager
+def share(variables):
+    """ The tf.Variables created in this context are replaced by the ones in `variables`, in the same order """
+    it = iter(variables)
+    shared = []
+
+    def creator(next_creator, **kwargs):
+        try:
+            v = next(it)
+        except StopIteration:
+            raise RuntimeError("The model creates more tf.Variables than the ones recorded. It cannot be shared.")
+        shared.append(v)
+        return v
+
+    _shared.append(shared)
+    try:
+        with tf.variable_creator_scope(creator):
+            yield
+    finally:
+        _shared.remove(shared)
+
+
+def is_shared(variable):
+    """ Returns True if the tf.Variable has been returned by an active share context instead of being created """
+    return any(variable is v for shared in _shared for v in shared)
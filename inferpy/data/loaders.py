@@ -18,6 +18,13 @@ from inferpy.util.session import get_session
 import csv
 
 
+# let tensorflow decide the parallelism and the buffer sizes at runtime
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+# key of the position of each instance in the data, included in the batches if requested
+ROW_INDEX = "inferpy-row-index"
+
+
 class DataLoader:
 
     """ This class defines the basic functionality of any DataLoader """
@@ -58,10 +65,43 @@ class DataLoader:
         """ Sets the size of the shuffle size where 1 implies no shuffle """
         self._shuffle_buffer_size = shuffle_buffer_size
 
-    def to_tfdataset(self):
-        """ Obtains a tensorflow dataset object"""
+    @property
+    def prefetch_buffer_size(self):
+        """ Number of batches prepared in background while the current one is being used """
+        return self._prefetch_buffer_size
+
+    @prefetch_buffer_size.setter
+    def prefetch_buffer_size(self, prefetch_buffer_size):
+        """ Sets the number of batches prepared in background """
+        self._prefetch_buffer_size = prefetch_buffer_size
+
+    @property
+    def num_parallel_calls(self):
+        """ Number of batches transformed in parallel by map_batch_fn in the dataset """
+        return self._num_parallel_calls
+
+    @num_parallel_calls.setter
+    def num_parallel_calls(self, num_parallel_calls):
+        """ Sets the number of batches transformed in parallel by map_batch_fn in the dataset """
+        self._num_parallel_calls = num_parallel_calls
+
+    def to_tfdataset(self, batch_size=None, epoch_batches=False, with_indices=False):
+        """ Obtains a tensorflow dataset object. If epoch_batches is True, each pass over the data is batched
+            independently, so the last batch of each pass contains the remaining instances. If with_indices is True,
+            the batches contain the position of each instance in the data, with the key ROW_INDEX.
+        """
         raise NotImplementedError
 
+    def to_mapped_tfdataset(self, batch_size=None, epoch_batches=False, with_indices=False):
+        """ Obtains a tensorflow dataset object whose batches are already transformed by map_batch_fn. The
+            transformation runs in parallel and the batches are prefetched, so it overlaps with their usage.
+        """
+        return (
+            self.to_tfdataset(batch_size, epoch_batches, with_indices)
+                .map(self.map_batch_fn, num_parallel_calls=self.num_parallel_calls)
+                .prefetch(self.prefetch_buffer_size)
+            )
+
     def to_dict(self):
         """ Obtains a dictionary with data as numpy objects"""
         raise NotImplementedError
@@ -72,7 +112,8 @@ class CsvLoader(DataLoader):
     """
     This class implements a data loader for datasets in CSV format
     """
-    def __init__(self, path, var_dict=None, has_header=None, force_eager=False):
+    def __init__(self, path, var_dict=None, has_header=None, force_eager=False, num_parallel_reads=None,
+                 num_parallel_calls=AUTOTUNE, prefetch_buffer_size=AUTOTUNE):
         """ Creates a new CsvLoader object
 
             Args:
@@ -83,6 +124,10 @@ class CsvLoader(DataLoader):
                 has_header (bool): indicates if the file has a header. If None, it will check it automatically.
                 force_eager (`bool`): indicates if the data should always be loaded before the optimization
                     loop, regardless of the inference method.
+                num_parallel_reads (`int`): number of csv files read in parallel. If None, all the files are
+                    read in parallel.
+                num_parallel_calls (`int`): number of batches transformed in parallel by map_batch_fn.
+                prefetch_buffer_size (`int`): number of batches prepared in background.
         """
 
         if isinstance(path, str):
@@ -123,6 +168,9 @@ class CsvLoader(DataLoader):
 
         self._path = path
         self._shuffle_buffer_size = 1
+        self._num_parallel_reads = num_parallel_reads if num_parallel_reads else len(path)
+        self._num_parallel_calls = num_parallel_calls
+        self._prefetch_buffer_size = prefetch_buffer_size
 
         if var_dict is None:
             var_dict = {self._colnames[i]: [i] for i in range(len(self._colnames))}
@@ -131,6 +179,16 @@ class CsvLoader(DataLoader):
         self._variables = list(var_dict.keys())
 
 
+    @property
+    def num_parallel_reads(self):
+        """ Number of csv files read in parallel """
+        return self._num_parallel_reads
+
+    @num_parallel_reads.setter
+    def num_parallel_reads(self, num_parallel_reads):
+        """ Sets the number of csv files read in parallel """
+        self._num_parallel_reads = num_parallel_reads
+
     def __build_map_batch_fn(self, var_dict):
         """ This functions sets the property map_batch_fn with the
             function transforming each batch and consistent with the desired
@@ -149,10 +207,14 @@ class CsvLoader(DataLoader):
         return fn
 
 
-    def to_tfdataset(self, batch_size = None):
+    def to_tfdataset(self, batch_size = None, epoch_batches = False, with_indices = False):
 
         if batch_size == None: batch_size = self.size
 
+        # the files are read in parallel, so the position of each row is not known
+        if with_indices:
+            raise ValueError("The indices of the instances cannot be obtained from csv files")
+
 
         if self.has_header:
             col_args = {"select_columns": self._colnames}
@@ -161,12 +223,19 @@ class CsvLoader(DataLoader):
                         "select_columns": list(range(1,len(self._colnames)+1))}
 
 
-        # build the dataset object
-        return tf.data.experimental.make_csv_dataset(self._path, batch_size=batch_size,
-                                                     sloppy=True, shuffle=self.shuffle_buffer_size>1,
-                                                     shuffle_buffer_size= self.shuffle_buffer_size,
-                                                     **col_args
-                                                    )
+        # build the dataset object. make_csv_dataset always ends with a prefetch, whose buffer is kept at the minimum
+        # because the batches are prefetched once they are transformed by map_batch_fn (see to_mapped_tfdataset)
+        dataset = tf.data.experimental.make_csv_dataset(self._path, batch_size=batch_size,
+                                                        sloppy=True, shuffle=self.shuffle_buffer_size>1,
+                                                        shuffle_buffer_size= self.shuffle_buffer_size,
+                                                        num_parallel_reads=self.num_parallel_reads,
+                                                        prefetch_buffer_size=1,
+                                                        num_epochs=1 if epoch_batches else None,
+                                                        **col_args
+                                                       )
+
+        # a single pass is batched (keeping the remainder) and then repeated
+        return dataset.repeat() if epoch_batches else dataset
 
 
     def to_dict(self):
@@ -183,7 +252,14 @@ class SampleDictLoader(DataLoader):
     """
     This class implements a data loader for datasets in memory stored as dictionaries
     """
-    def __init__(self, sample_dict):
+    def __init__(self, sample_dict, num_parallel_calls=AUTOTUNE, prefetch_buffer_size=AUTOTUNE):
+        """ Creates a new SampleDictLoader object
+
+            Args:
+                sample_dict (`dict`): mapping that associates each variable name to its data.
+                num_parallel_calls (`int`): number of batches transformed in parallel by map_batch_fn.
+                prefetch_buffer_size (`int`): number of batches prepared in background.
+        """
 
         self.sample_dict = sample_dict
 
@@ -195,15 +271,22 @@ class SampleDictLoader(DataLoader):
         self._size = list(sizes)[0]
         self._map_batch_fn = None
         self._shuffle_buffer_size = 1
+        self._num_parallel_calls = num_parallel_calls
+        self._prefetch_buffer_size = prefetch_buffer_size
         self._variables = list(sample_dict.keys())
 
 
-    def to_tfdataset(self, batch_size = None):
+    def to_tfdataset(self, batch_size = None, epoch_batches = False, with_indices = False):
 
         if batch_size == None: batch_size = self.size
 
+        sample_dict = dict(self.sample_dict, **{ROW_INDEX: tf.range(self.size, dtype=tf.int64)}) \
+            if with_indices else self.sample_dict
+
+        # each pass over the data is always batched independently. The batches are prefetched once they are
+        # transformed by map_batch_fn (see to_mapped_tfdataset)
         return (
-            tf.data.Dataset.from_tensor_slices(self.sample_dict)
+            tf.data.Dataset.from_tensor_slices(sample_dict)
                 .shuffle(self.shuffle_buffer_size)
                 .batch(batch_size)
                 .repeat()
@@ -226,7 +309,8 @@ def build_data_loader(data):
         if data._force_eager == False:
             data_loader = data
         else:
-            data_loader = SampleDictLoader(data.to_dict())
+            data_loader = SampleDictLoader(data.to_dict(), num_parallel_calls=data.num_parallel_calls,
+                                           prefetch_buffer_size=data.prefetch_buffer_size)
     else:
         raise TypeError('The `data` type must be dict or DataLoader.')
     return data_loader
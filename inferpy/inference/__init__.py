@@ -5,11 +5,20 @@ and returns a dict of posterior objects (random distributions, list of samples,
 
 from .variational.vi import VI
 from .variational.svi import SVI
+from .variational.natural_gradient_svi import NaturalGradientSVI
+from .variational.early_stopping import EarlyStopping
+from .variational.callbacks import Callback, MetricsBuffer
 from .mcmc import MCMC
+from .sgmcmc import SGMCMC
 
 
 __all__ = [
+    'Callback',
+    'EarlyStopping',
     'MCMC',
+    'MetricsBuffer',
+    'NaturalGradientSVI',
+    'SGMCMC',
     'SVI',
     'VI'
 ]
@@ -1,18 +1,35 @@
 # https://github.com/PGM-Lab/BBVI-TFP/blob/e45b1d654edb0f014665b719fdfc461429832f50/playground/edward2/log-regression-MCMC.py
 
+import multiprocessing
+import os
+import warnings
+
+import numpy as np
 import tensorflow as tf
 import tensorflow_probability as tfp
 from tensorflow_probability.python import edward2 as ed
+from tensorflow.python.framework import function
 
 from .inference import Inference
 from inferpy import models
 from inferpy.queries import Query
 from inferpy import util
+from inferpy import contextmanager
 from inferpy.data.loaders import build_sample_dict
 
 
+# number of draws of the init_from posterior used to estimate its scale
+_NUM_SCALE_SAMPLES = 100
+
+# maximum number of values of the draws loaded at once to compute the convergence diagnostics
+_DIAGNOSTICS_CHUNK_SIZE = 2 ** 22
+
+
 class MCMC(Inference):
-    def __init__(self, step_size=0.01, num_leapfrog_steps=5, num_burnin_steps=1000, num_results=500):
+    def __init__(self, step_size=0.01, num_leapfrog_steps=5, num_burnin_steps=1000, num_results=500, num_chains=1,
+                 adapt_step_size=False, target_accept_prob=0.75,
+                 num_steps_between_results=0, retain=None, chunk_size=None, spill_dir=None, num_workers=None,
+                 init_from=None, step_size_from_init=True):
         """Creates a new Markov Chain MonteCarlo (MCMC) Inference object.
             Args:
                 step_size: Tensor or Python list of Tensors representing the step size for the leapfrog integrator.
@@ -25,6 +42,39 @@ class MCMC(Inference):
                 num_burnin_steps: Integer number of chain steps to take before starting to collect results.
                                   Default value: 0 (i.e., no burn-in).
                 num_results: Integer number of Markov chain draws.
+                num_chains: Integer number of chains run in the same `tfp.mcmc.sample_chain` call, with their states
+                            stacked along a leading dimension. Each one starts from a different sample of the model.
+                            The draws of all the chains are used as posterior samples, and the potential scale
+                            reduction (R-hat, if there are several chains) and the effective sample size of each
+                            retained variable are computed once the sampling finishes, stored in `rhat` and `ess`.
+                adapt_step_size: If True, the step size is adapted during the first 80% of the burn-in steps to
+                                 reach the `target_accept_prob`, using `tfp.mcmc.SimpleStepSizeAdaptation`. The final
+                                 step size is stored in `adapted_step_size`.
+                target_accept_prob: The acceptance probability targeted by the step size adaptation.
+                num_steps_between_results: The number of chain steps between the collected draws (thinning). Each
+                                           draw is taken `num_steps_between_results + 1` steps after the previous one.
+                retain: The list with the names of the hidden variables whose draws are stored, or None to store all
+                        of them. Only the retained variables can be used in the `posterior` queries.
+                chunk_size: The number of draws computed in each session call, or None to compute all of them in a
+                            single call. Only one chunk of the chain is kept in memory by tensorflow.
+                spill_dir: If not None, the directory where the draws of each retained variable are written, chunk by
+                           chunk, as a memory-mapped `<name>.npy` file. The queries then read the draws from these
+                           files instead of keeping them in memory. The convergence diagnostics are also computed
+                           reading the draws from the files in slices of elements.
+                num_workers: If not None, the chains are run in `num_workers` worker processes instead of being
+                             stacked in the same graph. Each chain is run with its own graph and `tf.Session`, building
+                             the model again with the function decorated by `inf.probmodel` (which must be defined at
+                             the top level of a module), and their draws are merged in this process. The cores are
+                             split between the workers, setting the intra and inter op threads of their sessions. The
+                             workers are spawned, so they import the main module of the script again: the code which
+                             runs the inference must be inside an `if __name__ == "__main__":` block.
+                init_from: A fitted inference object (i.e. `VI` or `SVI`) or a `Query`, whose posterior draws are used
+                           as the initial state of the chains (one draw for each chain) instead of draws of the prior.
+                           The hidden variables not included in its posterior, or with a different shape, are
+                           initialized from the prior. It cannot be used with `num_workers`.
+                step_size_from_init: If True and `init_from` is used, the step size of each hidden variable is
+                                     `step_size` multiplied by the standard deviation of the posterior draws (element
+                                     wise), so `step_size` is relative to the posterior scale.
         """
 
         self.step_size = step_size
@@ -35,21 +85,56 @@ class MCMC(Inference):
 
         self.num_results = num_results
 
+        if num_chains < 1:
+            raise ValueError("num_chains must be a positive integer")
+        self.num_chains = num_chains
+
+        self.adapt_step_size = adapt_step_size
+        self.target_accept_prob = target_accept_prob
+        # the step size at the end of the adaptation, if adapt_step_size is True
+        self.adapted_step_size = None
+
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer")
+        self.num_steps_between_results = num_steps_between_results
+        self.retain = retain
+        self.chunk_size = chunk_size
+        self.spill_dir = spill_dir
+
+        if num_workers is not None and num_workers < 1:
+            raise ValueError("num_workers must be a positive integer")
+        self.num_workers = num_workers
+
+        if init_from is not None and num_workers is not None:
+            raise ValueError("init_from cannot be used with num_workers")
+        self.init_from = init_from
+        self.step_size_from_init = step_size_from_init
+        # the step size used by the kernel, which can be scaled by the posterior of init_from
+        self._chain_step_size = step_size
+
         # pmodel not established yet
         self.pmodel = None
         # The size of the plate when expand the models
         self.plate_size = None
 
-        # tensors where the results of applying MCMC are stored
+        # tensors where the results of applying MCMC are stored: the states of the first chunk of the chain, and
+        # the step size in its last draw (if it is adapted)
         self._states_tensor = None
-        self._kernel_results_tensor = None
-        # the final samples computed by applying the method
+        self._step_size_tensor = None
+        # the final samples computed by applying the method, and the arrays with their draws
         self.states = None
+        self._posterior_draws = None
+        # the convergence diagnostics of each hidden variable: potential scale reduction and effective sample size
+        self.rhat = None
+        self.ess = None
 
         # expanded variables and parameters
         self.expanded_variables = None
         self.expanded_parameters = None
 
+        # the function which computes the log prob of the model from the hidden state of a chain, defined once
+        self._log_prob_fn = None
+
         # not observed vars
         self.hiddenvars_name = None
 
@@ -72,16 +157,33 @@ class MCMC(Inference):
 
         sess = util.get_session()
 
-        with util.interceptor.disallow_conditions():
-            with ed.interception(util.interceptor.set_values(**sample_dict)):
-                # create the hmc kernel
-                self._generate_sample_chain(sample_dict)
+        if self.num_workers is not None:
+            draws = self._run_parallel_chains(sample_dict)
+        else:
+            with util.interceptor.disallow_conditions():
+                with ed.interception(util.interceptor.set_values(**sample_dict)):
+                    # create the kernel and the first chunk of the chain
+                    self._generate_sample_chain(sample_dict)
+
+                    draws = self._run_sample_chain(sess)
 
-                variables_states, _ = sess.run([self._states_tensor, self._kernel_results_tensor])
+        # the draws of all the chains are samples of the posterior
+        names = list(draws.keys())
+        rhat, ess = self._compute_diagnostics(sess, [draws[name] for name in names])
+        self.rhat = dict(zip(names, rhat)) if self.num_chains > 1 else None
+        self.ess = dict(zip(names, ess))
 
-        # event_ndims is the number of dims of states minus 1 because of the dimension of number os samples
-        self.states = {name: models.Empirical(states, event_ndims=len(states.shape) - 1, name=name)
-                       for name, states in zip(self.hiddenvars_name, variables_states)}
+        self.states = {}
+        self._posterior_draws = {}
+        for name, states in draws.items():
+            if self.num_chains > 1:
+                states = np.reshape(states, (-1, ) + states.shape[2:])
+            self._posterior_draws[name] = states
+            if self.spill_dir is None:
+                # event_ndims is the number of dims of states minus 1 because of the dimension of number os samples
+                self.states[name] = models.Empirical(states, event_ndims=len(states.shape) - 1, name=name)
+            else:
+                self.states[name] = _memmap_variable(states, name)
 
     def posterior(self, target_names=None, data={}):
         return Query(self.states, target_names, data)
@@ -94,10 +196,82 @@ class MCMC(Inference):
         }
         return Query(self.pmodel.vars, target_names, expanded_data)
 
+    def posterior_predictive_samples(self, target_names=None, data={}, num_draws=None):
+        """ Simulates the posterior predictive distribution for each posterior draw of the global hidden variables,
+            in a single session call.
+
+            Args:
+                target_names: The name (or list of names) of the variables to simulate. By default, all the variables
+                              which are not hidden.
+                data: A dict with the observed values of some variables (i.e. the covariates of new instances). The
+                      size of the datamodel is the size of this data, or the size of the data used to fit the model.
+                num_draws: The number of posterior draws used, evenly spaced among the stored ones. By default, all
+                           the stored draws are used.
+
+            Returns:
+                A dict with an array `[S, ...]` for each target variable, where S is the number of posterior draws.
+                The local hidden variables and the global ones which are not retained are sampled from their prior.
+        """
+        samples, feed_dict = self._generate_posterior_predictive(target_names, data, num_draws)
+        return util.get_session().run(samples, feed_dict=feed_dict)
+
+    def posterior_predictive_summary(self, target_names=None, data={}, quantiles=(0.05, 0.5, 0.95), num_draws=None):
+        """ Computes the mean and the quantiles of the posterior predictive samples (see
+            `posterior_predictive_samples`) in the same session call which simulates them, without fetching them.
+
+            Returns:
+                A dict with a dict for each target variable, with its `mean` and its `quantiles` (an array with a row
+                for each quantile).
+        """
+        samples, feed_dict = self._generate_posterior_predictive(target_names, data, num_draws)
+        summary = {name: {
+            "mean": tf.reduce_mean(tf.cast(s, util.floatx()), axis=0),
+            "quantiles": tf.stack([tfp.stats.percentile(s, 100. * q, axis=0) for q in quantiles])
+        } for name, s in samples.items()}
+        return util.get_session().run(summary, feed_dict=feed_dict)
+
     ########################
     # Auxiliar functions
     ########################
 
+    def _generate_posterior_predictive(self, target_names, data, num_draws):
+        """ Returns a dict with the tensors of the posterior predictive samples of the target variables, and the
+            feed_dict with the posterior draws. The model is expanded once using placeholders as global hidden
+            variables, and the ops between them and the targets are imported in a tf.map_fn over the draws. """
+        if self.states is None:
+            raise RuntimeError("The posterior predictive cannot be computed before running the inference method")
+        if isinstance(target_names, str):
+            target_names = [target_names]
+        if target_names is None:
+            target_names = [n for n in self.pmodel.vars if n not in self.hiddenvars_name and n not in data]
+
+        names = [n for n in self._posterior_draws if not self.pmodel.vars[n].is_datamodel and n not in data]
+        if len(names) == 0:
+            raise ValueError("There are no posterior draws of the global hidden variables")
+        draws = [self._posterior_draws[n] for n in names]
+        if num_draws is not None:
+            indices = np.linspace(0, len(draws[0]) - 1, num_draws).astype(int)
+            draws = [d[indices] for d in draws]
+
+        # expand de pmodel, using the intercept.set_values function, to include the data and placeholders as
+        # the global hidden variables
+        plate_size = util.iterables.get_plate_size(self.pmodel.vars, data) \
+            if any(self.pmodel.vars[k].is_datamodel for k in data if k in self.pmodel.vars) else self.plate_size
+        hidden_placeholders = [tf.placeholder(tf.as_dtype(d.dtype), d.shape[1:]) for d in draws]
+        simulate_fn, expanded_variables, _ = _define_model_function(
+            self.pmodel, plate_size, data, names, hidden_placeholders,
+            lambda variables: [variables[n].value for n in target_names])
+        targets = [expanded_variables[n].value for n in target_names]
+
+        def predictive_fn(draw):
+            return tuple(simulate_fn(*draw))
+
+        draws_placeholders = tuple(tf.placeholder(tf.as_dtype(d.dtype), d.shape) for d in draws)
+        samples = tf.map_fn(predictive_fn, draws_placeholders, dtype=tuple(t.dtype for t in targets),
+                            parallel_iterations=32)
+
+        return dict(zip(target_names, samples)), dict(zip(draws_placeholders, draws))
+
     def _generate_sample_chain(self, data):
 
         # check if model should be expanded for getting the the initial state
@@ -115,31 +289,311 @@ class MCMC(Inference):
                 # sample vars to use them as initial state
                 initial_state.append(var)
                 self.hiddenvars_name.append(name)
-        initial_state = util.get_session().run(initial_state)
+        chains_initial_state = [util.get_session().run(initial_state) for _ in range(self.num_chains)]
+        self._chain_step_size = self.step_size
+        if self.init_from is not None:
+            chains_initial_state = self._init_from_posterior(chains_initial_state)
+        if self.num_chains > 1:
+            # each chain starts from a different sample, stacked along the first dimension
+            initial_state = [np.stack(states) for states in zip(*chains_initial_state)]
+        else:
+            initial_state = chains_initial_state[0]
+
+        # define the log prob function once, using the state of a single chain
+        self._build_log_prob_fn(
+            data, [states[0] for states in initial_state] if self.num_chains > 1 else initial_state)
+
+        # initialize MCMC, including the burn-in steps in the first chunk of the chain
+        self._states_tensor, self._step_size_tensor = self._sample_chain(
+            initial_state, min(self._get_chunk_size(), self.num_results), self.num_burnin_steps,
+            self._chain_step_size, self.adapt_step_size)
+
+    def _sample_chain(self, current_state, num_results, num_burnin_steps, step_size, adapt_step_size):
+        states, kernel_results = tfp.mcmc.sample_chain(
+            num_results=num_results,
+            current_state=current_state,
+            kernel=self._make_kernel(step_size, adapt_step_size),
+            num_burnin_steps=num_burnin_steps,
+            num_steps_between_results=self.num_steps_between_results
+        )
+
+        if adapt_step_size:
+            # the step size used in the last draw
+            step_size = kernel_results.inner_results.accepted_results.step_size
+            step_size = [s[-1] for s in step_size] if isinstance(step_size, list) else step_size[-1]
+        else:
+            step_size = tf.no_op()
+        return states, step_size
+
+    def _init_from_posterior(self, chains_initial_state):
+        """ Replaces the initial state of each chain with a draw of the init_from posterior, and scales the step size
+            of each variable by the standard deviation of the posterior draws if step_size_from_init is True. """
+        query = self.init_from if isinstance(self.init_from, Query) else self.init_from.posterior()
+        samples = query.sample(max(self.num_chains, _NUM_SCALE_SAMPLES), simplify_result=False)
+
+        step_sizes = self.step_size if isinstance(self.step_size, list) else [self.step_size] * len(self.hiddenvars_name)
+        scaled_step_sizes = []
+        for i, name in enumerate(self.hiddenvars_name):
+            state = chains_initial_state[0][i]
+            if name not in samples or np.shape(samples[name])[1:] != np.shape(state):
+                warnings.warn("The variable {} cannot be initialized from the posterior of init_from, and its initial "
+                              "state is drawn from the prior".format(name))
+                scaled_step_sizes.append(step_sizes[i])
+                continue
+
+            draws = np.asarray(samples[name], dtype=state.dtype)
+            for chain, chain_initial_state in enumerate(chains_initial_state):
+                chain_initial_state[i] = draws[chain]
+            # the variables with a degenerate posterior keep the step size
+            std = np.std(draws, axis=0)
+            scaled_step_sizes.append(step_sizes[i] * np.where(std > 0, std, 1.).astype(state.dtype))
 
-        # initialize MCMC
-        hmc_kernel = tfp.mcmc.HamiltonianMonteCarlo(
+        if self.step_size_from_init:
+            self._chain_step_size = scaled_step_sizes
+        return chains_initial_state
+
+    def _run_sample_chain(self, sess):
+        """ Runs the chain chunk by chunk, storing the draws of the retained variables in memory or in the
+            memory-mapped files of the spill_dir. Each chunk starts from the last state of the previous one. """
+        names = self._get_retained_names()
+        indices = [self.hiddenvars_name.index(name) for name in names]
+
+        draws = {}
+        num_draws = 0
+        # the first chunk is computed by the tensors created in _generate_sample_chain
+        states_tensor, feed_dict = self._states_tensor, {}
+        chunk_length = min(self._get_chunk_size(), self.num_results)
+        while True:
+            chunk_draws, last_state, step_size = sess.run(
+                [[states_tensor[i] for i in indices], [s[-1] for s in states_tensor], self._step_size_tensor],
+                feed_dict=feed_dict)
+
+            if num_draws == 0:
+                self.adapted_step_size = step_size if self.adapt_step_size else None
+                draws = {name: self._allocate_draws(name, (self.num_results, ) + d.shape[1:], d.dtype)
+                         for name, d in zip(names, chunk_draws)}
+
+            # the last chunk can include more draws than the remaining ones
+            chunk_length = min(chunk_length, self.num_results - num_draws)
+            for name, d in zip(names, chunk_draws):
+                draws[name][num_draws:num_draws + chunk_length] = d[:chunk_length]
+            num_draws += chunk_length
+            if num_draws == self.num_results:
+                break
+
+            if not feed_dict:
+                # the next chunks start from the last state, without burn-in steps and with the final step size
+                current_state = [tf.placeholder(tf.as_dtype(s.dtype), s.shape) for s in last_state]
+                states_tensor, _ = self._sample_chain(
+                    current_state, self._get_chunk_size(), 0,
+                    self.adapted_step_size if self.adapt_step_size else self._chain_step_size, False)
+            feed_dict = dict(zip(current_state, last_state))
+
+        if self.spill_dir is not None:
+            # reopen the files in read mode, so the draws are read from the disk when they are used
+            for name in names:
+                draws[name].flush()
+                draws[name] = np.load(self._get_spill_path(name), mmap_mode="r")
+
+        return draws
+
+    def _run_parallel_chains(self, sample_dict):
+        """ Runs each chain in a worker process, and merges their draws stacking the chains along the second
+            dimension, as the chains run in the same graph. """
+        if self.pmodel.factory is None:
+            raise ValueError("The chains can only be run in worker processes if the model is created with a function "
+                             "decorated by inf.probmodel")
+
+        kwargs = dict(
+            step_size=self.step_size, num_leapfrog_steps=self.num_leapfrog_steps,
+            num_burnin_steps=self.num_burnin_steps, num_results=self.num_results,
+            adapt_step_size=self.adapt_step_size, target_accept_prob=self.target_accept_prob,
+            num_steps_between_results=self.num_steps_between_results, retain=self.retain, chunk_size=self.chunk_size)
+        # the cores are split between the processes, so their tensorflow thread pools do not compete for them
+        num_processes = min(self.num_workers, self.num_chains)
+        num_threads = max(1, (os.cpu_count() or 1) // num_processes)
+        tasks = [(self.pmodel.factory, sample_dict, dict(kwargs, spill_dir=self._get_chain_spill_dir(chain)),
+                  num_threads) for chain in range(self.num_chains)]
+
+        # the processes are spawned, so tensorflow is not shared with the forked state of this process
+        with multiprocessing.get_context("spawn").Pool(num_processes) as pool:
+            results = pool.map(_run_chain, tasks)
+
+        self.hiddenvars_name = results[0]["hiddenvars_name"]
+        self.adapted_step_size = [r["adapted_step_size"] for r in results] if self.adapt_step_size else None
+
+        draws = {}
+        for name in results[0]["draws"]:
+            chain_draws = [r["draws"][name] if self.spill_dir is None else
+                           np.load(os.path.join(self._get_chain_spill_dir(chain), "{}.npy".format(name)), mmap_mode="r")
+                           for chain, r in enumerate(results)]
+            if self.num_chains == 1:
+                draws[name] = chain_draws[0]
+                continue
+            draws[name] = self._allocate_draws(
+                name, (self.num_results, self.num_chains) + chain_draws[0].shape[1:], chain_draws[0].dtype)
+            for chain, d in enumerate(chain_draws):
+                draws[name][:, chain] = d
+            if self.spill_dir is not None:
+                draws[name].flush()
+                draws[name] = np.load(self._get_spill_path(name), mmap_mode="r")
+
+        return draws
+
+    def _get_chain_spill_dir(self, chain):
+        # the draws of each worker are written in their own directory, and merged in the spill_dir
+        if self.spill_dir is None:
+            return None
+        return self.spill_dir if self.num_chains == 1 else os.path.join(self.spill_dir, "chain-{}".format(chain))
+
+    def _compute_diagnostics(self, sess, draws):
+        """ Computes the potential scale reduction (if there are several chains) and the effective sample size of
+            each element of the draws. The elements are processed in slices of at most _DIAGNOSTICS_CHUNK_SIZE
+            values, read from the arrays (or the memory-mapped files) when they are used, so the draws of a
+            variable are never loaded in memory at once. """
+        # the draws are the first dimension of the states, and the chains the second one (if several chains)
+        sample_ndims = 2 if self.num_chains > 1 else 1
+        rhat, ess = [], []
+        for d in draws:
+            # a view of the draws with the elements of each state flattened in the last dimension
+            elements = np.reshape(d, d.shape[:sample_ndims] + (-1, ))
+            states = tf.placeholder(tf.as_dtype(d.dtype), elements.shape[:sample_ndims] + (None, ))
+            if self.num_chains > 1:
+                rhat_tensor = tfp.mcmc.potential_scale_reduction(states, independent_chain_ndims=1)
+                # the effective sample size of all the chains is the sum of the effective sample size of each one
+                ess_tensor = tf.reduce_sum(tfp.mcmc.effective_sample_size(states), axis=0)
+            else:
+                rhat_tensor = tf.no_op()
+                ess_tensor = tfp.mcmc.effective_sample_size(states)
+
+            size = max(1, _DIAGNOSTICS_CHUNK_SIZE // int(np.prod(elements.shape[:sample_ndims])))
+            results = [sess.run([rhat_tensor, ess_tensor], feed_dict={states: elements[..., i:i + size]})
+                       for i in range(0, elements.shape[-1], size)]
+
+            ess.append(np.reshape(np.concatenate([r[1] for r in results]), d.shape[sample_ndims:]))
+            if self.num_chains > 1:
+                rhat.append(np.reshape(np.concatenate([r[0] for r in results]), d.shape[sample_ndims:]))
+        return rhat, ess
+
+    def _get_retained_names(self):
+        if self.retain is None:
+            return list(self.hiddenvars_name)
+        if any(name not in self.hiddenvars_name for name in self.retain):
+            raise ValueError("The retained variables must be hidden variables of the model: {}".format(
+                self.hiddenvars_name))
+        return [name for name in self.hiddenvars_name if name in self.retain]
+
+    def _get_chunk_size(self):
+        return self.num_results if self.chunk_size is None else self.chunk_size
+
+    def _get_spill_path(self, name):
+        return os.path.join(self.spill_dir, "{}.npy".format(name))
+
+    def _allocate_draws(self, name, shape, dtype):
+        if self.spill_dir is None:
+            return np.empty(shape, dtype)
+        os.makedirs(self.spill_dir, exist_ok=True)
+        return np.lib.format.open_memmap(self._get_spill_path(name), mode="w+", dtype=dtype, shape=shape)
+
+    def _make_kernel(self, step_size, adapt_step_size):
+        kernel = tfp.mcmc.HamiltonianMonteCarlo(
             target_log_prob_fn=self._target_log_prob_fn,
-            step_size=self.step_size,
+            step_size=step_size,
             num_leapfrog_steps=self.num_leapfrog_steps
         )
 
-        self._states_tensor, self._kernel_results_tensor = tfp.mcmc.sample_chain(
-            num_results=self.num_results,
-            current_state=initial_state,
-            kernel=hmc_kernel,
-            num_burnin_steps=self.num_burnin_steps
+        if not adapt_step_size:
+            return kernel
+
+        # the step size is adapted during the first 80% of the burn-in steps
+        return tfp.mcmc.SimpleStepSizeAdaptation(
+            kernel,
+            num_adaptation_steps=int(0.8 * self.num_burnin_steps),
+            target_accept_prob=tf.cast(self.target_accept_prob, util.floatx())
         )
 
     def _target_log_prob_fn(self, *hiddenvars_tensors):
-        # expand de pmodel, using the intercept.set_values function, to include the sample_dict (done in `update`)
-        # and the hiddenvars_tensors
-        with ed.interception(util.interceptor.set_values(**{k: v for k, v in zip(
-                self.hiddenvars_name, hiddenvars_tensors
-                )})):
-            self.expanded_variables, self.expanded_parameters = self.pmodel.expand_model(self.plate_size)
+        if self.num_chains > 1:
+            # the log prob of each chain is computed with its own call of the function. They are independent, so
+            # they are computed in parallel in the same session call
+            return tf.stack([self._log_prob_fn(*chain_tensors) for chain_tensors in zip(
+                *[tf.unstack(t, num=self.num_chains) for t in hiddenvars_tensors])])
+        return self._log_prob_fn(*hiddenvars_tensors)
+
+    def _build_log_prob_fn(self, data, states):
+        # the hidden variables are placeholders with the shape of the states of a single chain
+        hidden_placeholders = [tf.placeholder(tf.as_dtype(s.dtype), s.shape, name="inferpy-mcmc-{}".format(name))
+                               for name, s in zip(self.hiddenvars_name, states)]
+        self._log_prob_fn, self.expanded_variables, self.expanded_parameters = _define_model_function(
+            self.pmodel, self.plate_size, data, self.hiddenvars_name, hidden_placeholders,
+            lambda variables: tf.reduce_sum([tf.reduce_sum(p.log_prob(p.value)) for p in variables.values()]))
+
+
+def _run_chain(task):
+    """ Runs a single chain of MCMC in a worker process, building the model again from its factory. The draws
+        are returned, unless they are written in the spill_dir. """
+    factory, sample_dict, kwargs, num_threads = task
+    util.set_session(tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=num_threads,
+                                                      inter_op_parallelism_threads=num_threads)))
+    builder, args, builder_kwargs = factory
+    pmodel = builder(*args, **builder_kwargs)
+    mcmc = MCMC(**kwargs)
+    pmodel.fit(sample_dict, mcmc)
+
+    return dict(
+        hiddenvars_name=mcmc.hiddenvars_name,
+        adapted_step_size=mcmc.adapted_step_size,
+        draws={name: None if mcmc.spill_dir is not None else np.asarray(state.distribution.samples.eval(
+            session=util.get_session())) for name, state in mcmc.states.items()}
+    )
+
+
+def _memmap_variable(draws, name):
+    """ Returns a random variable whose value is a draw read from the memory-mapped array `draws` each time it is
+        evaluated, so the draws are not loaded in memory or included in the graph. """
+    def read_draw():
+        return np.array(draws[np.random.randint(len(draws))])
+
+    value = tf.py_func(read_draw, [], tf.as_dtype(draws.dtype), stateful=True)
+    value.set_shape(draws.shape[1:])
+    return models.Deterministic(value, name=name)
+
+
+def _define_model_function(pmodel, plate_size, data, names, placeholders, output_fn):
+    """ Defines a function which expands the pmodel using its arguments (with the dtypes and shapes of `placeholders`)
+        as the values of the variables in `names`, and the `data` as the observed values, and returns
+        `output_fn(expanded_variables)`. The function is defined once, so each call only adds a call op to the graph.
+
+        The pmodel is first expanded with the placeholders, recording its tf.Variables, so the function uses them
+        instead of creating new ones.
+
+        Returns:
+            A tuple with the function, and the variables and parameters of the model expanded with the placeholders.
+    """
+    values = dict(zip(names, placeholders))
+    with util.interceptor.disallow_conditions(), contextmanager.shared_variables.record() as model_variables:
+        with ed.interception(util.interceptor.set_values(**data, **values)):
+            expanded_variables, expanded_parameters = pmodel.expand_model(plate_size)
+
+    # the outputs of the function do not have a static shape, so they are set from the outputs of the expanded model
+    outputs = output_fn(expanded_variables)
+    shapes = [o.shape for o in outputs] if isinstance(outputs, (list, tuple)) else [outputs.shape]
+
+    @function.Defun(*[p.dtype for p in placeholders])
+    def model_function(*tensors):
+        for t, p in zip(tensors, placeholders):
+            t.set_shape(p.shape)
+        with util.interceptor.disallow_conditions(), contextmanager.shared_variables.share(model_variables):
+            with ed.interception(util.interceptor.set_values(**data, **dict(zip(names, tensors)))):
+                function_variables, _ = pmodel.expand_model(plate_size)
+        return output_fn(function_variables)
 
-        energy = tf.reduce_sum(
-            [tf.reduce_sum(p.log_prob(p.value)) for p in self.expanded_variables.values()])
+    def call(*tensors):
+        # a function with a single output returns it instead of a list
+        results = model_function(*tensors)
+        results = [results] if len(shapes) == 1 else list(results)
+        for r, shape in zip(results, shapes):
+            r.set_shape(shape)
+        return results if isinstance(outputs, (list, tuple)) else results[0]
 
-        return energy
+    return call, expanded_variables, expanded_parameters
@@ -0,0 +1,193 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow_probability.python import edward2 as ed
+
+from .inference import Inference
+from inferpy import models
+from inferpy.queries import Query
+from inferpy import util
+from inferpy.data.loaders import build_data_loader
+
+
+# update rules which can be used by the SGMCMC inference method
+METHODS = ("sgld", "sghmc")
+
+
+class SGMCMC(Inference):
+    def __init__(self, method="sgld", step_size=1e-4, friction=0.1, batch_size=100, num_burnin_steps=1000,
+                 num_results=500, num_steps_between_results=0):
+        """Creates a new Stochastic Gradient Markov Chain Monte Carlo (SG-MCMC) Inference object. Each step of the
+            chain uses the gradient of the log joint probability computed with a batch of the data, where the
+            log likelihood of the batch is rescaled by N/M. Only the global hidden variables are sampled, so all
+            the variables inside the datamodel must be observed, and the hidden variables must be continuous with
+            an unconstrained support.
+
+            Args:
+                method: The update rule, `"sgld"` (Stochastic Gradient Langevin Dynamics, Welling and Teh, 2011) or
+                        `"sghmc"` (Stochastic Gradient Hamiltonian Monte Carlo, Chen et al., 2014).
+                step_size: The step size (learning rate) of the updates.
+                friction: The friction term of SGHMC, in (0, 1]. The momentum is multiplied by `1 - friction` in each
+                          step.
+                batch_size: The number of instances of the data used in each step.
+                num_burnin_steps: Integer number of chain steps to take before starting to collect results.
+                num_results: Integer number of Markov chain draws.
+                num_steps_between_results: The number of chain steps between the collected draws (thinning).
+        """
+        if method not in METHODS:
+            raise ValueError("The method must be one of {}".format(METHODS))
+        self.method = method
+        self.step_size = step_size
+        self.friction = friction
+        self.batch_size = batch_size
+        self.num_burnin_steps = num_burnin_steps
+        self.num_results = num_results
+        self.num_steps_between_results = num_steps_between_results
+
+        # pmodel not established yet
+        self.pmodel = None
+        # The weight of the log likelihood of each batch: N/M
+        self.batch_weight = None
+        # the size of the data (N), kept in a tf.Variable so it can change in each update
+        self._data_size = None
+        self._data_size_value = None
+
+        # the tf.Variables with the current state of the chain (and momentum, for SGHMC) of each hidden variable
+        self._state_variables = None
+        self._momentum_variables = None
+        # the tensor which runs a step of the chain, and contains the new state
+        self._step_tensor = None
+        # reinitializable iterator used to read the batches inside the graph
+        self._iterator = None
+        # the final samples computed by applying the method
+        self.states = None
+
+        # not observed vars
+        self.hiddenvars_name = None
+
+    def compile(self, pmodel, data_size, extra_loss_tensor=None):
+        # set the used pmodel
+        self.pmodel = pmodel
+        self._data_size = tf.Variable(data_size, trainable=False, dtype=util.floatx(), name="inferpy-sgmcmc-data-size")
+        util.get_session().run(tf.variables_initializer([self._data_size]))
+        self._data_size_value = data_size
+        self.batch_weight = self._data_size / self.batch_size  # N/M
+        # extra_loss_tensor comes from inf.layers.Sequential losses, which cannot be used with this inference method
+        if extra_loss_tensor is not None:
+            raise RuntimeError("The SGMCMC inference method cannot be used with models containing layers from tf, "
+                               "keras or inferpy.")
+
+        # the chain and the step tensor are created in the update function, when the observed variables are known
+        self._state_variables = None
+        self._step_tensor = None
+        self._iterator = None
+
+    def update(self, data):
+        data_loader = build_data_loader(data)
+        if data_loader.size < self.batch_size:
+            raise ValueError("The size of the data must be equal or greater than the batch size")
+
+        self._set_data_size(data_loader.size)
+        input_data = self._create_input_data_iterator(data_loader)
+        if self._step_tensor is None:
+            self._generate_step_tensor(data_loader.variables, input_data)
+
+        sess = util.get_session()
+
+        # the chain continues from its current state, so the burn-in steps are run in every update
+        for _ in range(self.num_burnin_steps):
+            sess.run(self._step_tensor)
+
+        draws = [np.empty((self.num_results, ) + tuple(v.shape.as_list()), v.dtype.as_numpy_dtype)
+                 for v in self._state_variables]
+        for i in range(self.num_results):
+            for _ in range(self.num_steps_between_results):
+                sess.run(self._step_tensor)
+            for d, state in zip(draws, sess.run(self._step_tensor)):
+                d[i] = state
+
+        # event_ndims is the number of dims of states minus 1 because of the dimension of number os samples
+        self.states = {name: models.Empirical(states, event_ndims=len(states.shape) - 1, name=name)
+                       for name, states in zip(self.hiddenvars_name, draws)}
+
+    def posterior(self, target_names=None, data={}):
+        return Query(self.states, target_names, data)
+
+    def posterior_predictive(self, target_names=None, data={}):
+        # posterior_predictive uses pmodel variables, but global hidden (parameters) intercepted with the draws.
+        expanded_data = {
+            **data,
+            **(util.runtime.try_run({k: v.sample() for k, v in self.states.items() if k not in data}))
+        }
+        return Query(self.pmodel.vars, target_names, expanded_data)
+
+    ########################
+    # Auxiliar functions
+    ########################
+
+    def _set_data_size(self, size):
+        # load the size of the data in the tf.Variable used to compute the batch_weight, only if it has changed
+        if size != self._data_size_value:
+            self._data_size.load(size, session=util.get_session())
+            self._data_size_value = size
+
+    def _create_input_data_iterator(self, data_loader):
+        # the same iterator (and therefore the same input data tensors) is used in every update,
+        # initialized with the dataset from each data_loader
+        data_loader.shuffle_buffer_size = data_loader.size
+        dataset = data_loader.to_mapped_tfdataset(self.batch_size)
+        # the last batch of each pass over the data can be smaller, and it is skipped
+        first_variable = data_loader.variables[0]
+        dataset = dataset.filter(lambda batch: tf.equal(tf.shape(batch[first_variable])[0], self.batch_size))
+        if self._iterator is None:
+            self._iterator = tf.data.Iterator.from_structure(dataset.output_types, dataset.output_shapes)
+        util.get_session().run(self._iterator.make_initializer(dataset))
+
+        # each time this tensor is evaluated in a session it contains new data
+        return self._iterator.get_next()
+
+    def _generate_step_tensor(self, observed_names, input_data):
+        local_hidden = [n for n, v in self.pmodel.vars.items() if v.is_datamodel and n not in observed_names]
+        if len(local_hidden) > 0:
+            raise ValueError("The SGMCMC inference method can only sample global hidden variables, but these "
+                             "variables in the datamodel are not observed: {}".format(local_hidden))
+
+        # the chain starts from a sample of the prior of the hidden variables
+        self.hiddenvars_name = [n for n in self.pmodel.vars if n not in observed_names]
+        initial_state = util.get_session().run([self.pmodel.vars[n] for n in self.hiddenvars_name])
+        # the chain is updated by the step tensor, not by an optimizer, so the variables are not trainable
+        self._state_variables = [tf.Variable(s, trainable=False, name="inferpy-sgmcmc-{}".format(n))
+                                 for n, s in zip(self.hiddenvars_name, initial_state)]
+        self._momentum_variables = [tf.Variable(tf.zeros_like(s), trainable=False,
+                                                name="inferpy-sgmcmc-momentum-{}".format(n))
+                                    for n, s in zip(self.hiddenvars_name, initial_state)] \
+            if self.method == "sghmc" else []
+        util.get_session().run(tf.variables_initializer(self._state_variables + self._momentum_variables))
+
+        # the log joint probability of a batch, with the log likelihood rescaled by N/M
+        states = [v.value() for v in self._state_variables]
+        batch_data = {k: tf.reshape(tf.cast(v, self.pmodel.vars[k].dtype),
+                                    [self.batch_size] + self.pmodel.vars[k].shape.as_list()[1:])
+                      for k, v in input_data.items() if k in self.pmodel.vars and self.pmodel.vars[k].is_datamodel}
+        with util.interceptor.disallow_conditions():
+            with ed.interception(util.interceptor.set_values(**dict(zip(self.hiddenvars_name, states)), **batch_data)):
+                expanded_variables, _ = self.pmodel.expand_model(self.batch_size)
+
+        log_prob = tf.reduce_sum(
+            [(self.batch_weight if v.is_datamodel else 1) * tf.reduce_sum(v.log_prob(v.value))
+             for v in expanded_variables.values()])
+        grads = tf.gradients(log_prob, states)
+
+        if self.method == "sgld":
+            # half step in the direction of the gradient, plus gaussian noise with variance step_size
+            self._step_tensor = [var.assign_add(0.5 * self.step_size * g + _noise(var, self.step_size))
+                                 for var, g in zip(self._state_variables, grads)]
+        else:
+            # the momentum is decreased by the friction, and the noise compensates the noise of the gradient
+            momentums = [m.assign((1. - self.friction) * m + self.step_size * g +
+                                  _noise(m, 2. * self.friction * self.step_size))
+                         for m, g in zip(self._momentum_variables, grads)]
+            self._step_tensor = [var.assign_add(m) for var, m in zip(self._state_variables, momentums)]
+
+
+def _noise(var, variance):
+    return tf.random_normal(tf.shape(var), stddev=np.sqrt(variance), dtype=var.dtype.base_dtype)
@@ -0,0 +1,87 @@
+import numpy as np
+
+
+class Callback:
+    def __init__(self, batch_interval=1):
+        """Base class of the callbacks called by the variational inference methods during the gradient descent
+            process. The callbacks only receive the values already computed by the inference method, so they never
+            require an extra evaluation of the model.
+
+            Args:
+                batch_interval (`int`): The `on_batch_end` function is called every `batch_interval` steps
+        """
+        if batch_interval < 1:
+            raise ValueError("batch_interval must be a positive integer")
+        self.batch_interval = batch_interval
+
+    def on_batch_end(self, step, logs):
+        """ Called at the end of a step (a batch in SVI) of the gradient descent process.
+
+            Args:
+                step (`int`): The number of the step, counting the steps of all the epochs
+                logs (`dict`): The `step_time` and `examples_per_sec` of the step, and its `loss` if it has been
+                    evaluated in this step
+        """
+        pass
+
+    def on_epoch_end(self, epoch, logs):
+        """ Called at the end of an epoch of the gradient descent process.
+
+            Args:
+                epoch (`int`): The number of the epoch
+                logs (`dict`): The `epoch_time` of the epoch, and its `loss` if it has been evaluated (the mean loss
+                    of the evaluated batches in SVI)
+        """
+        pass
+
+
+class MetricsBuffer:
+    # name of the metrics recorded in each step, in the order of the columns of the buffer
+    NAMES = ('loss', 'step_time', 'examples_per_sec')
+
+    def __init__(self, capacity=1024):
+        """Array-backed buffer with the metrics recorded in each step of the gradient descent process: the loss
+            (NaN if it has not been evaluated in the step), the step time in seconds and the number of examples
+            processed per second. The array is preallocated, and its capacity is doubled when it is full.
+
+            Args:
+                capacity (`int`): The initial number of steps which can be recorded
+        """
+        self._data = np.full((max(capacity, 1), len(self.NAMES)), np.nan)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def loss(self):
+        return self._data[:self._size, 0]
+
+    @property
+    def step_time(self):
+        return self._data[:self._size, 1]
+
+    @property
+    def examples_per_sec(self):
+        return self._data[:self._size, 2]
+
+    def reserve(self, steps):
+        """ Ensures that `steps` more steps can be recorded without growing the array """
+        capacity = self._size + steps
+        if capacity > len(self._data):
+            data = np.full((max(capacity, 2 * len(self._data)), len(self.NAMES)), np.nan)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+
+    def record(self, loss, step_time, examples):
+        """ Records the metrics of a step. The loss is None if it has not been evaluated """
+        if self._size == len(self._data):
+            self.reserve(1)
+        row = self._data[self._size]
+        row[0] = np.nan if loss is None else loss
+        row[1] = step_time
+        row[2] = examples / step_time if step_time > 0 else np.nan
+        self._size += 1
+
+    def clear(self):
+        self._size = 0
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+class EarlyStopping:
+    def __init__(self, tolerance=1e-4, patience=10, smoothing=0.9):
+        """Creates a new convergence criterion to stop the gradient descent process before running all the epochs.
+            The loss is smoothed using an exponential moving average, and the process stops when the relative
+            change of the smoothed loss is lower than `tolerance` during `patience` consecutive epochs.
+
+            Args:
+                tolerance (`float`): The relative change of the smoothed loss considered as no improvement
+                patience (`int`): The number of consecutive epochs without improvement before stopping
+                smoothing (`float`): The decay of the exponential moving average, in [0, 1). The greater
+                    it is, the smoother the loss
+        """
+        if tolerance < 0:
+            raise ValueError("tolerance must be a non-negative number")
+        if patience < 1:
+            raise ValueError("patience must be a positive integer")
+        if not 0 <= smoothing < 1:
+            raise ValueError("smoothing must be in the interval [0, 1)")
+
+        self.tolerance = tolerance
+        self.patience = patience
+        self.smoothing = smoothing
+
+        # the smoothed loss, and the number of consecutive epochs without improvement
+        self.smoothed_loss = None
+        self.wait = 0
+
+    def reset(self):
+        self.smoothed_loss = None
+        self.wait = 0
+
+    def update(self, loss):
+        """ Updates the smoothed loss with the loss of a new epoch.
+
+            Returns:
+                True if the process has converged and should be stopped, False otherwise.
+        """
+        if self.smoothed_loss is None:
+            self.smoothed_loss = loss
+            return False
+
+        previous_loss = self.smoothed_loss
+        self.smoothed_loss = self.smoothing * previous_loss + (1 - self.smoothing) * loss
+
+        relative_change = np.abs(self.smoothed_loss - previous_loss) / max(np.abs(previous_loss), np.finfo(float).eps)
+        self.wait = self.wait + 1 if relative_change < self.tolerance else 0
+
+        return self.wait >= self.patience
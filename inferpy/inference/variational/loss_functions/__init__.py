@@ -1,5 +1,7 @@
 from .elbo import ELBO
+from .iwelbo import IWELBO
 
 __all__ = [
-    'ELBO'
+    'ELBO',
+    'IWELBO'
 ]
@@ -1,35 +1,105 @@
 import tensorflow as tf
+import tensorflow_probability as tfp
+from tensorflow_probability.python.distributions import kullback_leibler
 
 
-def ELBO(pvars, qvars, batch_weight=1, **kwargs):
+def ELBO(pvars, qvars, batch_weight=1, num_particles=1, analytic_kl=True, replicate=None, **kwargs):
     """ Compute the loss tensor from the expanded variables of p and q models.
         Args:
             pvars (`dict<inferpy.RandomVariable>`): The dict with the expanded p random variables
             qvars (`dict<inferpy.RandomVariable>`): The dict with the expanded q random variables
             batch_weight (`float`): Weight to assign less importance to the energy, used when processing data in batches
+            num_particles (`int`): The number of samples of the q variables used to estimate the ELBO. To use more
+                than one, build the loss function with `functools.partial(ELBO, num_particles=S)`
+            analytic_kl (`bool`): If True, the exact KL divergence is used for each pair of p and q hidden variables
+                with the same name whose distributions have a registered `tfp.distributions.kl_divergence`, instead
+                of estimating it with the sampled log probs
+            replicate (`function`): Function provided by the inference method which receives a number of replicas,
+                and returns a list of tuples (pvars, qvars) with new expansions of the p and q models sharing their
+                variables. Each replica draws a new sample, and all of them are computed in the same session call
 
         Returns (`tf.Tensor`):
             The generated loss tensor
     """
 
-    # compute energy
-    energy = tf.reduce_sum(
-        [(batch_weight if p.is_datamodel else 1) * tf.reduce_sum(p.log_prob(p.value))
-         for p in pvars.values()])
+    particles = [(pvars, qvars)]
+    if num_particles > 1:
+        if replicate is None:
+            raise ValueError("The inference method does not allow to use more than one particle")
+        particles += replicate(num_particles - 1)
+
+    # average the ELBO of the particles
+    ELBO = tf.reduce_mean([_elbo(p, q, batch_weight, analytic_kl) for p, q in particles])
+
+    # This function will be minimized. Return minus ELBO
+    return -ELBO
+
 
-    q_mask = tf.stack([tf.math.logical_not(q.is_observed) for q in qvars.values()], name="q_mask")
+def _elbo(pvars, qvars, batch_weight, analytic_kl):
+    # pairs of p and q variables whose KL divergence is computed analytically
+    kl_names = [k for k, q in qvars.items() if k in pvars and _has_analytic_kl(q, pvars[k])] if analytic_kl else []
+
+    # compute energy
+    energy = _reduce_sum(
+        [(batch_weight if p.is_datamodel else 1) * _sum_log_prob(p)
+         for k, p in pvars.items() if k not in kl_names])
 
     # compute entropy
-    entropy = - tf.reduce_sum(
-        tf.boolean_mask(
-            tf.stack(
-                [(batch_weight if q.is_datamodel else 1) * tf.reduce_sum(q.log_prob(q.value)) for q in qvars.values()]
-                )
-            , q_mask)
-    )
+    qvars_entropy = [q for k, q in qvars.items() if k not in kl_names]
+    if len(qvars_entropy) > 0:
+        # variables built without the is_observed tf.Variable (i.e. in a disallow_conditions context) are hidden
+        q_mask = tf.stack([tf.math.logical_not(q.is_observed) if q.is_observed is not None else tf.constant(True)
+                           for q in qvars_entropy], name="q_mask")
+
+        entropy = - tf.reduce_sum(
+            tf.boolean_mask(
+                tf.stack(
+                    [(batch_weight if q.is_datamodel else 1) * _sum_log_prob(q)
+                     for q in qvars_entropy]
+                    )
+                , q_mask)
+        )
+    else:
+        entropy = 0.
+
+    # compute the analytic terms: minus KL(q || p) for hidden variables, or the energy if they are observed
+    analytic = _reduce_sum(
+        [(batch_weight if qvars[k].is_datamodel else 1) * _kl_term(pvars[k], qvars[k]) for k in kl_names])
 
     # compute ELBO
-    ELBO = energy + entropy
+    return energy + entropy + analytic
 
-    # This function will be minimized. Return minus ELBO
-    return -ELBO
+
+def _sum_log_prob(rv):
+    # the log probs can be computed in float16, but they are added in float32 to avoid overflows
+    return tf.reduce_sum(_to_float32(rv.log_prob(rv.value)))
+
+
+def _to_float32(tensor):
+    return tf.cast(tensor, tf.float32) if tensor.dtype == tf.float16 else tensor
+
+
+def _reduce_sum(terms):
+    # tf.reduce_sum cannot be used with empty lists
+    return tf.reduce_sum(terms) if len(terms) > 0 else 0.
+
+
+def _has_analytic_kl(q, p):
+    # look up the registry of KL functions (including those of the parent classes), without building the KL ops
+    return kullback_leibler._registered_kl(type(q.distribution), type(p.distribution)) is not None
+
+
+def _kl_term(p, q):
+    # computed in float32, as the log probs, to avoid overflows
+    kl = _to_float32(tfp.distributions.kl_divergence(q.distribution, p.distribution))
+    # the KL has the batch shape of the distributions, which does not include the sample_shape of the variables.
+    # Scale it by the number of samples in the value not covered by the batch shape
+    event_size = tf.reduce_prod(q.distribution.event_shape_tensor())
+    num_samples = tf.cast(tf.size(q.value), kl.dtype) / tf.cast(tf.size(kl) * event_size, kl.dtype)
+    neg_kl = - num_samples * tf.reduce_sum(kl)
+
+    if q.is_observed is None:
+        return neg_kl
+
+    # if the variable is observed, it is not approximated by q and only its energy is used
+    return tf.where(q.is_observed, _sum_log_prob(p), neg_kl)
@@ -0,0 +1,78 @@
+import math
+import tensorflow as tf
+
+
+def IWELBO(pvars, qvars, batch_weight=1, num_samples=5, replicate=None, **kwargs):
+    """ Compute the loss tensor using the importance weighted bound (Burda et al., 2015) from the expanded variables
+        of p and q models.
+        Args:
+            pvars (`dict<inferpy.RandomVariable>`): The dict with the expanded p random variables
+            qvars (`dict<inferpy.RandomVariable>`): The dict with the expanded q random variables
+            batch_weight (`float`): Weight to assign less importance to the energy, used when processing data in batches
+            num_samples (`int`): The number of samples (K) of the q variables used to compute the bound. To use a
+                different number, build the loss function with `functools.partial(IWELBO, num_samples=K)`
+            replicate (`function`): Function provided by the inference method which receives a number of replicas,
+                and returns a list of tuples (pvars, qvars) with new expansions of the p and q models sharing their
+                variables. Each replica draws a new sample, and all of them are computed in the same session call
+
+        If the q model only has local hidden variables, the importance weights are computed for each instance of the
+        datamodel plate. Otherwise, they are computed for the joint of all the variables.
+
+        Returns (`tf.Tensor`):
+            The generated loss tensor
+    """
+
+    samples = [(pvars, qvars)]
+    if num_samples > 1:
+        if replicate is None:
+            raise ValueError("The inference method does not allow to use more than one sample")
+        samples += replicate(num_samples - 1)
+
+    # log importance weights of the variables outside the datamodel (shape [K]), and of the variables inside the
+    # datamodel, for each instance of the plate (shape [K, M])
+    global_log_weights = tf.stack([_log_weights(p, q, is_datamodel=False) for p, q in samples])
+    local_log_weights = tf.stack([_log_weights(p, q, is_datamodel=True) for p, q in samples])
+
+    if any(not q.is_datamodel for q in qvars.values()):
+        # the global hidden variables are shared by all the instances: use the joint importance weights
+        log_weights = global_log_weights + batch_weight * _reduce_instances(local_log_weights)
+        IWELBO = tf.reduce_logsumexp(log_weights) - math.log(num_samples)
+    else:
+        # the local hidden variables of each instance are independent: use the importance weights of each instance
+        IWELBO = tf.reduce_mean(global_log_weights) + batch_weight * tf.reduce_sum(
+            tf.reduce_logsumexp(local_log_weights, axis=0) - math.log(num_samples))
+
+    # This function will be minimized. Return minus IWELBO
+    return -IWELBO
+
+
+def _log_weights(pvars, qvars, is_datamodel):
+    # log p - log q of the variables inside or outside the datamodel. Inside, it is computed for each instance
+    terms = [_log_prob(p, is_datamodel) for p in pvars.values() if p.is_datamodel == is_datamodel] + \
+        [-_hidden_log_prob(q, is_datamodel) for q in qvars.values() if q.is_datamodel == is_datamodel]
+    return tf.add_n(terms) if len(terms) > 0 else tf.constant(0.)
+
+
+def _log_prob(rv, by_instance):
+    # the sum of the log probs of the value, keeping the first dimension (the datamodel plate) if by_instance.
+    # The log probs can be computed in float16, but they are added in float32 to avoid overflows
+    log_prob = rv.log_prob(rv.value)
+    if log_prob.dtype == tf.float16:
+        log_prob = tf.cast(log_prob, tf.float32)
+    if by_instance:
+        return tf.reduce_sum(log_prob, axis=tf.range(1, tf.rank(log_prob)))
+    return tf.reduce_sum(log_prob)
+
+
+def _hidden_log_prob(q, by_instance):
+    # the observed q variables are not approximated, so their log prob is not used.
+    # Variables built without the is_observed tf.Variable (i.e. in a disallow_conditions context) are hidden
+    log_prob = _log_prob(q, by_instance)
+    if q.is_observed is None:
+        return log_prob
+    return log_prob * tf.cast(tf.logical_not(q.is_observed), log_prob.dtype)
+
+
+def _reduce_instances(local_log_weights):
+    # sum the log weights of all the instances of each sample, if there are variables inside the datamodel
+    return tf.reduce_sum(local_log_weights, axis=tf.range(1, tf.rank(local_log_weights)))
@@ -0,0 +1,235 @@
+import tensorflow as tf
+import tensorflow_probability as tfp
+
+from .svi import SVI
+
+
+tfd = tfp.distributions
+
+
+# Natural parameters of the supported exponential family distributions. For each class, a function which computes
+# the list of natural parameters from a distribution object, and a function which computes the arguments of the
+# distribution (by name) from its natural parameters
+_NATURAL_PARAMETERS = {
+    tfd.Normal: (
+        lambda d: [d.loc / tf.square(d.scale), -0.5 / tf.square(d.scale)],
+        lambda eta: {"loc": -0.5 * eta[0] / eta[1], "scale": tf.sqrt(-0.5 / eta[1])}
+    ),
+    tfd.Gamma: (
+        lambda d: [d.concentration - 1., -d.rate],
+        lambda eta: {"concentration": eta[0] + 1., "rate": -eta[1]}
+    ),
+    tfd.Beta: (
+        lambda d: [d.concentration1 - 1., d.concentration0 - 1.],
+        lambda eta: {"concentration1": eta[0] + 1., "concentration0": eta[1] + 1.}
+    ),
+    tfd.Dirichlet: (
+        lambda d: [d.concentration - 1.],
+        lambda eta: {"concentration": eta[0] + 1.}
+    ),
+}
+
+
+# Conjugate pairs (prior class, likelihood class). For each pair, the name of the argument of the likelihood which
+# must be the prior variable, and a function which computes the sufficient statistics of the samples of the
+# likelihood, in the same order as the natural parameters of the prior
+_CONJUGATE_PAIRS = {
+    (tfd.Normal, tfd.Normal): (
+        "loc",
+        lambda d, x: [x / tf.square(d.scale), tf.zeros_like(x) - 0.5 / tf.square(d.scale)]
+    ),
+    (tfd.Gamma, tfd.Poisson): (
+        "rate",
+        lambda d, x: [x, -tf.ones_like(x)]
+    ),
+    (tfd.Beta, tfd.Bernoulli): (
+        "probs",
+        lambda d, x: [tf.cast(x, d.probs.dtype), 1. - tf.cast(x, d.probs.dtype)]
+    ),
+    (tfd.Dirichlet, tfd.Categorical): (
+        "probs",
+        lambda d, x: [tf.one_hot(x, tf.shape(d.probs)[-1], dtype=d.probs.dtype)]
+    ),
+}
+
+
+# Inverse of the element-wise transformations which can be applied to a Parameter to build a q distribution argument
+_INVERSE_TRANSFORMS = {
+    "Softplus": tfp.math.softplus_inverse,
+    "Exp": tf.math.log,
+}
+
+
+class NaturalGradientSVI(SVI):
+    def __init__(self, *args, learning_rate_delay=1., forgetting_rate=0.7, **kwargs):
+        """Creates a new Stochastic Variational Inference object which uses natural gradient updates for the
+            global hidden variables with a conjugate prior (Hoffman et al., 2013). A global variable is updated
+            this way if all the variables which depend on it in the p model are conjugate likelihoods using it
+            as argument, and the arguments of its q variable are `inf.Parameter` objects (or their softplus or
+            exponential). The rest of the parameters are updated using the optimizer.
+
+            Args:
+                *args: list of arguments used for the super().__init__ function
+                *kwargs: dict of arguments used for the super().__init__ function
+                learning_rate_delay (`float`): The delay (tau) of the step size of the natural gradient updates,
+                    which is `(t + learning_rate_delay) ** -forgetting_rate` in the step t
+                forgetting_rate (`float`): The forgetting rate (kappa) of the step size, in (0.5, 1]
+        """
+        super().__init__(*args, **kwargs)
+
+        if self.num_replicas > 1:
+            raise ValueError("num_replicas cannot be used with NaturalGradientSVI")
+        # the natural gradient updates are computed without loss scaling, so float16 gradients could underflow
+        if self.mixed_precision:
+            raise ValueError("mixed_precision cannot be used with NaturalGradientSVI")
+
+        self.learning_rate_delay = learning_rate_delay
+        self.forgetting_rate = forgetting_rate
+        # names of the global hidden variables updated using natural gradients
+        self.conjugate_variables = []
+
+    ########################
+    # Auxiliar functions
+    ########################
+
+    def _generate_train_op(self, loss_tensors):
+        pvars = self.expanded_variables["p"]
+        qvars = self.expanded_variables["q"]
+        qparameters = [p.var for p in self.expanded_parameters["q"].values()]
+
+        # find the variables with a natural gradient update, and the assign operations to do it
+        updates = {}
+        for name in qvars:
+            update = self._get_natural_gradient_update(name, pvars, qvars, qparameters)
+            if update is not None:
+                updates[name] = update
+        self.conjugate_variables = list(updates.keys())
+
+        # the rest of the variables are updated using the optimizer
+        updated_variables = [var for _, _, _, parameters in updates.values() for _, var, _ in parameters]
+        var_list = [v for v in tf.trainable_variables() if v not in updated_variables]
+        loss_tensor = loss_tensors[0]
+        grads_and_vars = [(g, v) for g, v in self.optimizer.compute_gradients(loss_tensor, var_list=var_list)
+                          if g is not None] if var_list else []
+        # if there are no more variables to update, the loss tensor is just evaluated
+        train = self.optimizer.apply_gradients(grads_and_vars) if grads_and_vars else tf.group(loss_tensor)
+
+        if len(updates) == 0:
+            return loss_tensor, train
+
+        # the step size decreases with the number of steps
+        step = tf.Variable(0., trainable=False, name="natural_gradient_step")
+        rho = tf.pow(step + self.learning_rate_delay, -self.forgetting_rate)
+
+        # the natural gradient updates are run once the loss tensor has been used by the optimizer. The step is
+        # done in the space of the natural parameters, and the result is transformed into the q distribution arguments
+        with tf.control_dependencies([train]):
+            assigns = []
+            for from_natural, current, target, parameters in updates.values():
+                args = from_natural([(1. - rho) * c + rho * t for c, t in zip(current, target)])
+                assigns += [var.assign(inverse(args[arg_name])) for arg_name, var, inverse in parameters]
+        with tf.control_dependencies(assigns):
+            train = step.assign_add(1.)
+
+        return loss_tensor, train
+
+    def _get_natural_gradient_update(self, name, pvars, qvars, qparameters):
+        """ Checks if the global hidden variable `name` can be updated using natural gradients, and computes the
+            intermediate estimate of its natural parameters using the sufficient statistics of its likelihoods.
+
+            Returns:
+                None if the variable is not updated using natural gradients, otherwise a tuple
+                (from_natural, current, target, parameters): the function which computes the q distribution
+                arguments from the natural parameters, the current and target natural parameters, and a list with a
+                tuple (argument name, variable, inverse) for each q Parameter, where inverse is the function to
+                transform the argument into the value of the Parameter.
+        """
+        if name not in pvars or pvars[name].is_datamodel or qvars[name].is_datamodel:
+            return None
+
+        prior = pvars[name].distribution
+        posterior = qvars[name].distribution
+        family = _get_family(prior)
+        if family is None or not isinstance(posterior, family):
+            return None
+        to_natural, from_natural = _NATURAL_PARAMETERS[family]
+
+        # all the variables depending on this one must be conjugate likelihoods
+        children = list(self.pmodel.graph.successors(name))
+        if len(children) == 0 or any(c not in pvars for c in children):
+            return None
+
+        # the natural parameters of the q distribution
+        current = to_natural(posterior)
+        shape = tf.broadcast_static_shape(current[0].shape, current[-1].shape)
+
+        # the intermediate estimate: prior natural parameters plus the weighted sufficient statistics
+        target = [tf.broadcast_to(eta, shape) for eta in to_natural(prior)]
+        for child in children:
+            likelihood = pvars[child].distribution
+            pair = _CONJUGATE_PAIRS.get((family, _get_family(likelihood, _CONJUGATE_CLASSES)))
+            if pair is None:
+                return None
+            argument, sufficient_statistics = pair
+            if likelihood.parameters.get(argument) is not pvars[name].var.value:
+                return None
+
+            weight = self.batch_weight if pvars[child].is_datamodel else 1
+            statistics = sufficient_statistics(likelihood, pvars[child].value)
+            target = [eta + weight * _sum_to_shape(stat, shape) for eta, stat in zip(target, statistics)]
+
+        # the arguments of the q distribution must be Parameters (or an invertible transformation of them)
+        parameters = []
+        for arg_name in from_natural(current):
+            parameter = _get_parameter(posterior.parameters.get(arg_name), qparameters)
+            if parameter is None:
+                return None
+            var, inverse = parameter
+            # the Parameter must have the shape of the natural parameters to be assigned
+            if var.shape.as_list() != shape.as_list():
+                return None
+            parameters.append((arg_name, var, inverse))
+
+        return from_natural, current, target, parameters
+
+
+# classes which can be likelihoods in a conjugate pair
+_CONJUGATE_CLASSES = list({likelihood for _, likelihood in _CONJUGATE_PAIRS})
+
+
+def _get_family(distribution, classes=_NATURAL_PARAMETERS):
+    # the supported class of the distribution, or None
+    for cls in classes:
+        if isinstance(distribution, cls):
+            return cls
+    return None
+
+
+def _get_parameter(tensor, variables):
+    # if the tensor is the value of one of the variables, or an invertible transformation of it,
+    # return the variable and the inverse transformation. Otherwise, return None
+    if not isinstance(tensor, tf.Tensor):
+        return None
+
+    inverse = tf.identity
+    if tensor.op.type in _INVERSE_TRANSFORMS:
+        inverse = _INVERSE_TRANSFORMS[tensor.op.type]
+        tensor = tensor.op.inputs[0]
+
+    # the value of a tf.Variable is read using an Identity (or ReadVariableOp) operation
+    if tensor.op.type in ("Identity", "ReadVariableOp"):
+        for var in variables:
+            if tensor.op.inputs[0].op is var.op:
+                return var, inverse
+    return None
+
+
+def _sum_to_shape(statistic, shape):
+    # sum the sufficient statistics of all the samples, reducing the leading dimensions and the broadcasted ones
+    extra_dims = statistic.shape.ndims - shape.ndims
+    if extra_dims > 0:
+        statistic = tf.reduce_sum(statistic, axis=list(range(extra_dims)))
+    broadcasted_dims = [i for i, d in enumerate(shape.as_list()) if d == 1]
+    if broadcasted_dims and statistic.shape.ndims == shape.ndims:
+        statistic = tf.reduce_sum(statistic, axis=broadcasted_dims, keepdims=True)
+    return tf.broadcast_to(statistic, shape)
@@ -1,82 +1,261 @@
+import math
+import time
 import numpy as np
 import tensorflow as tf
 
 from inferpy import util
 from inferpy import contextmanager
 from .vi import VI
-from inferpy.data.loaders import build_data_loader, DataLoader
+from inferpy.data.loaders import build_data_loader, DataLoader, ROW_INDEX
 
 
 class SVI(VI):
-    def __init__(self, *args, batch_size=100, **kwargs):
+    def __init__(self, *args, batch_size=100, direct_input=False, num_replicas=1, sparse_local_parameters=False,
+                 **kwargs):
         """Creates a new Stochastic Variational Inference object.
 
             Args:
                 *args: list of arguments used for the super().__init__ function
                 *kwargs: dict of arguments used for the super().__init__ function
                 batch_size (`int`): The number of epochs to run in the gradient descent process
+                direct_input (`bool`): If True, the batches obtained from the `tf.data` iterator are used directly
+                    in the graph as the values of the observed variables, instead of being evaluated and loaded
+                    into the expanded models in each step. The `get_next()` tensor of the iterator is an input of every
+                    `tf.cond` branch of the observed variables, so any evaluation of the expanded models (including the
+                    posterior queries after fit) pulls a batch from the iterator
+                num_replicas (`int`): The number of replicas of the expanded models used to process each batch in
+                    parallel. Each replica processes `batch_size / num_replicas` instances, and their gradients are
+                    averaged and applied once. The batch slices are always read inside the graph (`direct_input`)
+                sparse_local_parameters (`bool`): If True, the Parameters declared inside a datamodel are tables with
+                    a row for each instance of the data, and only the rows of the instances in the batch are used and
+                    updated in each step. Use an optimizer which supports sparse updates (i.e. `GradientDescent`,
+                    `Adagrad` or `tf.contrib.opt.LazyAdamOptimizer`) so the cost of each step does not depend on the
+                    size of the data. The data must be a dict in memory, and it cannot be used with `direct_input`
+
+            If `dynamic_plate` is True, the last batch of each epoch contains the remaining instances of the data,
+            and the `batch_weight` is computed for the size of each batch. The size of the data is read from a
+            tf.Variable, so the `batch_weight` is also updated when `partial_fit` uses data of a different size.
         """
         # Build the super object
         super().__init__(*args, **kwargs)
 
+        # the in-graph train loop requires the data to be available in the graph, not loaded in each batch
+        if self.steps_per_loop is not None:
+            raise ValueError("steps_per_loop cannot be used with SVI")
+
+        if num_replicas < 1 or batch_size % num_replicas != 0:
+            raise ValueError("num_replicas must be a positive integer which divides the batch_size")
+
+        # the batch cannot be split into slices of the same size if its size is dynamic
+        if self.dynamic_plate and num_replicas > 1:
+            raise ValueError("num_replicas cannot be used with a dynamic plate size")
+
         # and save the extra argument batch size
         self.batch_size = batch_size
-        self.plate_size = batch_size  # the plate_size matches the batch_size
+        self.num_replicas = num_replicas
+        self.plate_size = batch_size // num_replicas  # the plate_size matches the batch_size processed by each replica
         self.batches = None
         self.batch_weight = None
+        # the tf.Variable with the size of the data used to compute the batch_weight, and the value loaded in it
+        self._data_size = None
+        self._data_size_value = None
+
+        # each replica reads its slice of the batch inside the graph
+        self.direct_input = direct_input or num_replicas > 1
+        # with direct_input, the train tensor is generated once the input data tensors are available
+        self._extra_loss_tensor = None
+        # reinitializable iterator used to read the batches inside the graph
+        self._iterator = None
+
+        # the rows of the local parameters are selected with the indices of the instances loaded in each batch
+        if sparse_local_parameters and self.direct_input:
+            raise ValueError("sparse_local_parameters cannot be used with direct_input or num_replicas")
+        self.sparse_local_parameters = sparse_local_parameters
+        # the tf.Variable with the indices of the instances in the batch, and the number of rows of the tables
+        self._batch_indices = None
+        self._local_parameters_size = None
 
     def compile(self, pmodel, data_size, extra_loss_tensor=None):
         # set the used pmodel
         self.pmodel = pmodel
-        # compute the batch_weight depending on the data_size and the batch_size
-        self.batch_weight = data_size / self.batch_size  # N/M
-        # create the train tensor
-        self.train_tensor = self._generate_train_tensor(extra_loss_tensor, batch_weight=self.batch_weight)
+        # compute the batch_weight depending on the data_size and the batch_size of each replica. The data size is
+        # read from a tf.Variable, so the batch_weight is updated if the size of the data changes in each update
+        self._data_size = tf.Variable(data_size, trainable=False, dtype=util.floatx(), name="inferpy-data-size")
+        util.get_session().run(tf.variables_initializer([self._data_size]))
+        self._data_size_value = data_size
+        if self.dynamic_plate:
+            # the plate size is read from a tf.Variable, so the batch_weight is computed for the size of each batch
+            self.plate_size = self._make_plate_size_variable(self.batch_size)
+            self.batch_weight = self._data_size / tf.cast(self.plate_size, util.floatx())  # N/M
+        else:
+            self.batch_weight = self._data_size / self.plate_size  # N/M
+        if self.direct_input:
+            # the train tensor is generated in the update function, when the input data is known
+            self._extra_loss_tensor = extra_loss_tensor
+            self._iterator = None
+            self.train_tensor = None
+        elif self.sparse_local_parameters:
+            # create the train tensor, building the local parameters as tables with a row for each instance
+            self._local_parameters_size = data_size
+            # with a dynamic plate size (a tf.Variable), the last batch of each epoch contains less indices
+            self._batch_indices = tf.Variable(tf.cast(tf.range(self.plate_size), tf.int64), trainable=False,
+                                              validate_shape=not self.dynamic_plate, name="inferpy-batch-indices")
+            util.get_session().run(tf.variables_initializer([self._batch_indices]))
+            with contextmanager.local_parameters.gather(self._batch_indices, data_size):
+                self.train_tensor = self._generate_train_tensor(extra_loss_tensor, batch_weight=self.batch_weight)
+        else:
+            # create the train tensor
+            self.train_tensor = self._generate_train_tensor(extra_loss_tensor, batch_weight=self.batch_weight)
 
     def update(self, data):
+        """ Run the gradient descent process using the data in batches.
+
+            Returns:
+                The number of epochs completed, which is lower than `epochs` if the convergence criterion was met.
+        """
 
         # create the input_data tensor
         data_loader = build_data_loader(data)
-        input_data = self.create_input_data_tensor(data_loader)
+        if self.sparse_local_parameters and data_loader.size != self._local_parameters_size:
+            raise ValueError("The size of the data must be equal to the number of rows of the local parameters: {}"
+                             .format(self._local_parameters_size))
+        self._set_data_size(data_loader.size)
+        if self.direct_input:
+            input_data = self.create_input_data_iterator(data_loader)
+            if self.train_tensor is None:
+                self.train_tensor = self._generate_train_tensor(self._extra_loss_tensor,
+                                                                input_data=self._reshape_input_data(input_data),
+                                                                num_replicas=self.num_replicas,
+                                                                batch_weight=self.batch_weight)
+        else:
+            input_data = self.create_input_data_tensor(data_loader)
+
+        self._reset_early_stopping()
+        self.current_epoch = self.initial_epoch
 
         t = []
         sess = util.get_session()
-        for i in range(self.epochs):
+        self.metrics.reserve((self.epochs - self.initial_epoch) * self.batches)
+        for i in range(self.initial_epoch, self.epochs):
+            epoch_losses = []
+            epoch_time = 0.
             for j in range(self.batches):
-                # evaluate the data tensor to get an evaluated one which can be used to observe varoables
-                local_input_data = sess.run(input_data)
-                # reshape data in case it does not match exactly with the shape used when building the random variable
-                # i.e.: (..., 1) dimension
-                clean_local_input_data = {k: np.reshape(v, self.expanded_variables["p"][k].observed_value.shape.as_list())
-                                          for k, v in local_input_data.items()}
-                with contextmanager.observe(self.expanded_variables["p"], clean_local_input_data):
-                    with contextmanager.observe(self.expanded_variables["q"], clean_local_input_data):
-                        sess.run(self.train_tensor)
-
-                        t.append(sess.run(self.debug.loss_tensor))
-                        if j == 0 and i % 200 == 0:
-                            print("\n {} epochs\t {}".format(i, t[-1]), end="", flush=True)
-                        if j == 0 and i % 20 == 0:
-                            print(".", end="", flush=True)
+                step = i * self.batches + j
+                batch_size = self._get_batch_size(data_loader.size, j) if self.dynamic_plate else self.batch_size
+                if self.dynamic_plate:
+                    self._set_plate_size(batch_size)
+                record_loss = self._is_loss_record_step(step)
+                print_loss = self.verbose and j == 0 and i % 200 == 0
+                # the loss is only fetched if it needs to be stored, printed or checked for convergence
+                fetch_loss = record_loss or print_loss or self.early_stopping is not None
+                start = time.perf_counter()
+                if self.direct_input:
+                    # the batch is obtained from the iterator in the same session call
+                    loss = self._run_train_step(sess, fetch_loss=fetch_loss)
+                else:
+                    loss = self._run_batch_train_step(sess, input_data, fetch_loss=fetch_loss)
+                step_time = time.perf_counter() - start
+                epoch_time += step_time
+
+                if record_loss:
+                    t.append(loss)
+                if fetch_loss:
+                    epoch_losses.append(loss)
+                if print_loss:
+                    print("\n {} epochs\t {}".format(i, loss), end="", flush=True)
+                if self.verbose and j == 0 and i % 20 == 0:
+                    print(".", end="", flush=True)
+                self._end_step(step, step_time, batch_size, loss)
+
+            self.current_epoch = i + 1
+            # the loss of the epoch is the mean loss of the evaluated batches
+            epoch_loss = np.mean(epoch_losses) if len(epoch_losses) > 0 else None
+            self._end_epoch(i, epoch_time, epoch_loss)
+            self._save_periodic_checkpoint(i, t)
+            # the convergence is checked using the mean loss of the batches in the epoch
+            if self.early_stopping is not None and self._is_converged(i, epoch_loss):
+                break
 
         # set the protected _losses attribute for the losses property
         self.debug.losses += t
+        # the next update starts from the beginning, unless a checkpoint is restored
+        self.initial_epoch = 0
+
+        return self.current_epoch
 
     def create_input_data_tensor(self, data_loader):
         # NOTE: data_size, batches and batch_weight can be different in each iteration
+        dataset = self._create_dataset(data_loader)
+        iterator = dataset.make_one_shot_iterator()
+
+        # each time this tensor is evaluated in a session it contains new data
+        input_data = iterator.get_next()
+
+        return input_data
+
+    def create_input_data_iterator(self, data_loader):
+        # the same iterator (and therefore the same input data tensors) is used in every update,
+        # initialized with the dataset from each data_loader
+        dataset = self._create_dataset(data_loader)
+        if self._iterator is None:
+            self._iterator = tf.data.Iterator.from_structure(dataset.output_types, dataset.output_shapes)
+        util.get_session().run(self._iterator.make_initializer(dataset))
 
-        # create a tf dataset and an iterator, specifying the batch size
+        # each time this tensor is evaluated in a session it contains new data
+        input_data = self._iterator.get_next()
+
+        return input_data
+
+    ########################
+    # Auxiliar functions
+    ########################
+
+    def _create_dataset(self, data_loader):
+        # create a tf dataset, specifying the batch size
         data_size = data_loader.size
-        self.batches = int(data_size / self.batch_size)  # M/N
+        if self.dynamic_plate:
+            # the last batch contains the remaining instances
+            self.batches = math.ceil(data_size / self.batch_size)
+        else:
+            self.batches = int(data_size / self.batch_size)  # M/N
 
         # ensure that the number of batches is equal or greater than 1
         if self.batches < 1:
             raise ValueError("The size of the data must be equal or greater than the batch size")
 
         data_loader.shuffle_buffer_size = data_size
-        iterator = data_loader.to_tfdataset(self.batch_size).make_one_shot_iterator()
+        # batches are transformed and prefetched in background, overlapping with the optimization steps
+        # with a dynamic plate size, the batches of each epoch are independent, so no instance is left out
+        return data_loader.to_mapped_tfdataset(self.batch_size, epoch_batches=self.dynamic_plate,
+                                               with_indices=self.sparse_local_parameters)
 
-        # each time this tensor is evaluated in a session it contains new data
-        input_data = data_loader.map_batch_fn(iterator.get_next())
+    def _set_data_size(self, size):
+        # load the size of the data in the tf.Variable used to compute the batch_weight, only if it has changed
+        if size != self._data_size_value:
+            self._data_size.load(size, session=util.get_session())
+            self._data_size_value = size
 
-        return input_data
+    def _get_batch_size(self, data_size, batch):
+        # the size of a batch in an epoch: all of them contain batch_size instances but the last one
+        return min(self.batch_size, data_size - batch * self.batch_size)
+
+    def _reshape_input_data(self, input_data):
+        # reshape data in case it does not match exactly with the shape used when building the random variable
+        # i.e.: (..., 1) dimension. The non expanded variables have 1 as the size of the datamodel plate
+        batch_size = -1 if self.dynamic_plate else self.batch_size
+        return {k: tf.reshape(tf.cast(v, self._get_compute_dtype(self.pmodel.vars[k].dtype)),
+                              [batch_size] + self.pmodel.vars[k].shape.as_list()[1:])
+                for k, v in input_data.items() if k in self.pmodel.vars and self.pmodel.vars[k].is_datamodel}
+
+    def _run_batch_train_step(self, sess, input_data, fetch_loss):
+        # evaluate the data tensor to get an evaluated one which can be used to observe varoables
+        local_input_data = sess.run(input_data)
+        # select the rows of the local parameters used in this batch
+        if self.sparse_local_parameters:
+            self._batch_indices.load(local_input_data.pop(ROW_INDEX), session=sess)
+        # reshape data in case it does not match exactly with the shape used when building the random variable
+        # i.e.: (..., 1) dimension
+        clean_local_input_data = {k: np.reshape(v, self._observed_value_shape(k)) for k, v in local_input_data.items()}
+        with contextmanager.observe(self.expanded_variables["p"], clean_local_input_data):
+            with contextmanager.observe(self.expanded_variables["q"], clean_local_input_data):
+                return self._run_train_step(sess, fetch_loss=fetch_loss)
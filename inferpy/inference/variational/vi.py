@@ -2,9 +2,12 @@ import numpy as np
 import tensorflow as tf
 import inspect
 import itertools
+import re
+import time
 from tensorflow_probability.python import edward2 as ed
 
 from . import loss_functions
+from .callbacks import MetricsBuffer
 import inferpy as inf
 from inferpy.queries import Query
 from inferpy import util
@@ -16,7 +19,9 @@ from inferpy.data.loaders import build_sample_dict
 
 
 class VI(Inference):
-    def __init__(self, qmodel, loss='ELBO', optimizer='AdamOptimizer', epochs=1000):
+    def __init__(self, qmodel, loss='ELBO', optimizer='AdamOptimizer', epochs=1000, loss_record_interval=1,
+                 steps_per_loop=None, early_stopping=None, dynamic_plate=False, callbacks=None, verbose=True,
+                 mixed_precision=False, warm_start=None, checkpoint_path=None, checkpoint_interval=100):
         """Creates a new Variational Inference object.
 
             Args:
@@ -27,6 +32,34 @@ class VI(Inference):
                 optimizer (`str` or `tf.train.Optimizer`): An optimizer object from `tf.train` optimizers, or a string
                     that refers to the name of an optimizer in such module or package
                 epochs (`int`): The number of epochs to run in the gradient descent process
+                loss_record_interval (`int`): The loss is stored in `debug.losses` every `loss_record_interval`
+                    steps. Use 1 to store it in every step, or 0 or None to never store it
+                steps_per_loop (`int`): If not None, up to `steps_per_loop` steps of the gradient descent process are
+                    run inside a single `tf.while_loop`, and their losses are obtained as a single tensor. This
+                    reduces the overhead of calling the session in each step. The model variables must be named
+                    `inf.Parameter` objects (i.e. layers are not allowed). If the convergence criterion is met inside
+                    a loop, its remaining steps have already been run: `current_epoch` (and the checkpoints) count
+                    them, while `stopped_epoch` is the epoch where the criterion was met
+                early_stopping (`EarlyStopping`): If not None, the convergence criterion used to stop the gradient
+                    descent process before running all the epochs. Then, `epochs` is the maximum number of epochs
+                dynamic_plate (`bool`): If True, the models are expanded with a plate size read from a `tf.Variable`
+                    when running the graph, so the same train tensor can be used with data of any size. The models
+                    cannot contain Parameters inside a datamodel context
+                callbacks (`list<Callback>`): The callbacks called at the end of each step and epoch with the metrics
+                    of the gradient descent process, which are also recorded in the `metrics` buffer
+                verbose (`bool`): If True, the progress of the gradient descent process is printed
+                mixed_precision (`bool`): If True, the models are expanded using float16 as default float type, while
+                    the `inf.Parameter` tf.Variables are kept in float32. The log probs are added in float32, and the
+                    loss is dynamically scaled to avoid the underflow of the float16 gradients
+                warm_start (`VI`, `dict` or `str`): If not None, the variables of the expanded models (parameters and
+                    layer weights) are initialized with the values from a previously fitted `VI` object, a snapshot
+                    obtained with `get_snapshot`, or the path of a snapshot saved with `save_snapshot`. The variables
+                    are matched by name (see `get_snapshot`), and the ones not found or with a different shape are
+                    initialized as usual
+                checkpoint_path (`str`): If not None, the training state is saved with `save_checkpoint` in this path
+                    every `checkpoint_interval` epochs during the gradient descent process, so it can be resumed with
+                    `restore_checkpoint` if the process is interrupted
+                checkpoint_interval (`int`): The number of epochs between the checkpoints saved in `checkpoint_path`
         """
 
         # store the qmodel in self.qmodel. Can be a callable with no parameters which returns the qmodel
@@ -46,6 +79,27 @@ class VI(Inference):
 
         self.epochs = epochs
 
+        # how often (in number of steps) the loss is fetched and stored in debug.losses
+        if loss_record_interval is not None and loss_record_interval < 0:
+            raise ValueError("loss_record_interval must be a non-negative integer or None")
+        self.loss_record_interval = loss_record_interval
+
+        if steps_per_loop is not None and steps_per_loop < 1:
+            raise ValueError("steps_per_loop must be a positive integer or None")
+        self.steps_per_loop = steps_per_loop
+
+        self.early_stopping = early_stopping
+        self.callbacks = list(callbacks) if callbacks else []
+        self.verbose = verbose
+        self.mixed_precision = mixed_precision
+        # the loss, step time and examples per second of each step
+        self.metrics = MetricsBuffer()
+        # the epoch at which the last update stopped if the convergence criterion was met, otherwise None
+        self.stopped_epoch = None
+        # the number of epochs completed, and the epoch where the next update starts (set when resuming)
+        self.current_epoch = 0
+        self.initial_epoch = 0
+
         # store the optimizer function in self.optimizer
         # if it is a string, build a new optimizer from tf.train (default parametrization)
         if isinstance(optimizer, str):
@@ -55,10 +109,29 @@ class VI(Inference):
 
         # pmodel not established yet
         self.pmodel = None
-        # The size of the plate when expand the models
+        # The size of the plate when expand the models (a tf.Variable if the plate size is dynamic)
         self.plate_size = None
+        self.dynamic_plate = dynamic_plate
+        # the value loaded in the plate size tf.Variable
+        self._plate_size_value = None
         # The tensor to optimize the tf.Variables
         self.train_tensor = None
+        # The in-graph train loops (number of steps placeholder and losses tensor), by observed variable names
+        self._train_loops = {}
+        # The loss scale and the number of steps with finite gradients, if mixed_precision is True
+        self._loss_scale_variables = None
+        # The extra arguments used to call the loss function
+        self._loss_kwargs = {}
+        # The saver for the training state, and the checkpoint to restore once the train tensor is generated
+        self._saver = None
+        self._pending_checkpoint = None
+        if checkpoint_interval is None or checkpoint_interval < 1:
+            raise ValueError("checkpoint_interval must be a positive integer")
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        # the values used to initialize the variables of the expanded models, and these variables
+        self.warm_start = warm_start
+        self._model_variables = []
 
         # expanded variables and parameters
         self.expanded_variables = {"p": None, "q": None}
@@ -82,43 +155,131 @@ class VI(Inference):
         # set the used pmodel
         self.pmodel = pmodel
         # and the plate size, which matches the data size
-        self.plate_size = data_size
+        self.plate_size = self._make_plate_size_variable(data_size) if self.dynamic_plate else data_size
+        # the variables of layers cannot be shared by the in-graph train loop
+        if self.steps_per_loop and extra_loss_tensor is not None:
+            raise ValueError("steps_per_loop cannot be used with models containing layers from tf, keras or inferpy.")
         # create the train tensor
         self.train_tensor = self._generate_train_tensor(extra_loss_tensor, plate_size=self.plate_size)
 
     def update(self, data):
+        """ Run the gradient descent process using the data.
+
+            Returns:
+                The number of epochs completed, which is lower than `epochs` if the convergence criterion was met.
+        """
 
         # data must be a sample dictionary
         sample_dict = build_sample_dict(data)
         # ensure that the size of the data matches with the self.plate_size
         data_size = util.iterables.get_plate_size(self.pmodel.vars, sample_dict)
-        if data_size != self.plate_size:
+        if self.dynamic_plate:
+            self._set_plate_size(data_size)
+        elif data_size != self.plate_size:
             raise ValueError("The size of the data must be equal to the plate size: {}".format(self.plate_size))
 
+        self._reset_early_stopping()
+        self.current_epoch = self.initial_epoch
+
         t = []
         sess = util.get_session()
+        self.metrics.reserve(self.epochs - self.initial_epoch)
         # reshape data in case it does not match exactly with the shape used when building the random variable
         # i.e.: (..., 1) dimension
-        clean_sample_dict = {k: np.reshape(v, self.expanded_variables["p"][k].observed_value.shape.as_list())
-                             for k, v in sample_dict.items()}
+        clean_sample_dict = {k: np.reshape(v, self._observed_value_shape(k)) for k, v in sample_dict.items()}
         with contextmanager.observe(self.expanded_variables["p"], clean_sample_dict):
             with contextmanager.observe(self.expanded_variables["q"], clean_sample_dict):
-                for i in range(self.epochs):
-                    sess.run(self.train_tensor)
-
-                    t.append(sess.run(self.debug.loss_tensor))
-                    if i % 200 == 0:
-                        print("\n {} epochs\t {}".format(i, t[-1]), end="", flush=True)
-                    if i % 10 == 0:
-                        print(".", end="", flush=True)
+                if self.steps_per_loop:
+                    t = self._run_train_loop(sess, list(clean_sample_dict.keys()), data_size)
+                else:
+                    for i in range(self.initial_epoch, self.epochs):
+                        record_loss = self._is_loss_record_step(i)
+                        print_loss = self.verbose and i % 200 == 0
+                        # the loss is only fetched if it needs to be stored, printed or checked for convergence
+                        start = time.perf_counter()
+                        loss = self._run_train_step(
+                            sess, fetch_loss=record_loss or print_loss or self.early_stopping is not None)
+                        step_time = time.perf_counter() - start
+
+                        if record_loss:
+                            t.append(loss)
+                        if print_loss:
+                            print("\n {} epochs\t {}".format(i, loss), end="", flush=True)
+                        if self.verbose and i % 10 == 0:
+                            print(".", end="", flush=True)
+                        self.current_epoch = i + 1
+                        # each epoch is a single step
+                        self._end_step(i, step_time, data_size, loss)
+                        self._end_epoch(i, step_time, loss)
+                        self._save_periodic_checkpoint(i, t)
+                        if self._is_converged(i, loss):
+                            break
 
         # set the protected _losses attribute for the losses property
         self.debug.losses += t
+        # the next update starts from the beginning, unless a checkpoint is restored
+        self.initial_epoch = 0
+
+        return self.current_epoch
 
     @property
     def losses(self):
         return self.debug.losses
 
+    def save_checkpoint(self, path):
+        """ Saves the training state in local disk: the variables created to train the models (the expanded
+            parameters, layer weights and optimizer variables), the loss history and the number of epochs completed.
+
+            Args:
+                path (`str`): The prefix of the checkpoint files
+        """
+        if self._saver is None:
+            raise RuntimeError("save_checkpoint cannot be used before compiling the inference method.")
+
+        self._save_checkpoint(path, self.debug.losses)
+
+    def restore_checkpoint(self, path):
+        """ Restores the training state saved by `save_checkpoint`. The next update resumes the gradient descent
+            process from the epoch where the checkpoint was saved. If the inference method has not been compiled
+            yet, the state is restored once the train tensor is generated (i.e. when fitting the model).
+
+            Args:
+                path (`str`): The prefix of the checkpoint files
+        """
+        if self._saver is None:
+            self._pending_checkpoint = path
+            return
+
+        self._saver.restore(util.get_session(), path)
+        state = np.load(path + ".state.npz")
+        self.debug.losses = list(state["losses"])
+        self.current_epoch = self.initial_epoch = int(state["epoch"])
+
+    def get_snapshot(self):
+        """ Obtains the values of the variables of the expanded models (parameters and layer weights), which can be
+            used to initialize the variables of other inference object using the `warm_start` argument.
+
+            The key of each variable is its name without the suffixes added by tensorflow to make the names unique
+            (i.e. `dense_1/kernel` is `dense/kernel`), followed by the number of previous variables with the same
+            name (i.e. `dense/kernel:0`), so the same model built in a different graph obtains the same keys.
+
+            Returns:
+                A dict with the value of each variable, by key.
+        """
+        if len(self._model_variables) == 0:
+            raise RuntimeError("get_snapshot cannot be used before compiling the inference method.")
+
+        values = util.get_session().run(self._model_variables)
+        return dict(zip(_snapshot_keys(self._model_variables), values))
+
+    def save_snapshot(self, path):
+        """ Saves the values of the variables of the expanded models (see `get_snapshot`) in a npz file.
+
+            Args:
+                path (`str`): The path of the npz file
+        """
+        np.savez(path, **self.get_snapshot())
+
     def get_interceptable_condition_variables(self):
         return (self.enable_interceptor_global, self.enable_interceptor_local)
 
@@ -135,33 +296,273 @@ class VI(Inference):
     # Auxiliar functions
     ########################
 
-    def _generate_train_tensor(self, extra_loss_tensor, **kwargs):
+    def _make_plate_size_variable(self, size):
+        # the models are expanded using this tf.Variable as plate size, which can be changed without recompiling
+        plate_size = tf.Variable(size, trainable=False, name="inferpy-plate-size")
+        util.get_session().run(tf.variables_initializer([plate_size]))
+        self._plate_size_value = size
+        return plate_size
+
+    def _set_plate_size(self, size):
+        # load the size of the data to process in the plate size tf.Variable, only if it has changed
+        if size != self._plate_size_value:
+            self.plate_size.load(size, session=util.get_session())
+            self._plate_size_value = size
+
+    def _observed_value_shape(self, name):
+        # the shape used to load the data of a variable into its observed_value tf.Variable
+        shape = self.expanded_variables["p"][name].observed_value.shape
+        if shape.is_fully_defined():
+            return shape.as_list()
+        # with a dynamic plate size, the number of rows depends on the data. The non expanded variables have 1 as the
+        # size of the datamodel plate
+        return [-1] + self.pmodel.vars[name].shape.as_list()[1:]
+
+    def _save_checkpoint(self, path, losses):
+        self._saver.save(util.get_session(), path, write_meta_graph=False)
+        np.savez(path + ".state.npz", losses=np.array(losses), epoch=self.current_epoch)
+
+    def _save_periodic_checkpoint(self, previous_epoch, update_losses):
+        """ Saves a checkpoint in checkpoint_path if an interval of checkpoint_interval epochs has been completed
+            since `previous_epoch`. The losses stored in the current update (`update_losses`) are not in
+            `debug.losses` yet, so they are included in the checkpoint. """
+        if self.checkpoint_path is not None and \
+                self.current_epoch // self.checkpoint_interval > previous_epoch // self.checkpoint_interval:
+            self._save_checkpoint(self.checkpoint_path, self.debug.losses + update_losses)
+
+    def _reset_early_stopping(self):
+        self.stopped_epoch = None
+        if self.early_stopping is not None:
+            self.early_stopping.reset()
+
+    def _is_converged(self, epoch, loss):
+        # update the convergence criterion with the loss of the epoch, and store the epoch if it is met
+        if self.early_stopping is not None and self.early_stopping.update(loss):
+            self.stopped_epoch = epoch
+            if self.verbose:
+                print("\n Converged at epoch {}\t {}".format(epoch, loss), end="", flush=True)
+            return True
+        return False
+
+    def _end_step(self, step, step_time, examples, loss):
+        # record the metrics of the step, and call the callbacks with them
+        self.metrics.record(loss, step_time, examples)
+        if self.callbacks:
+            logs = {"step_time": step_time, "examples_per_sec": self.metrics.examples_per_sec[-1]}
+            if loss is not None:
+                logs["loss"] = loss
+            for callback in self.callbacks:
+                if step % callback.batch_interval == 0:
+                    callback.on_batch_end(step, logs)
+
+    def _end_epoch(self, epoch, epoch_time, loss):
+        # call the callbacks with the metrics of the epoch
+        if self.callbacks:
+            logs = {"epoch_time": epoch_time}
+            if loss is not None:
+                logs["loss"] = loss
+            for callback in self.callbacks:
+                callback.on_epoch_end(epoch, logs)
+
+    def _is_loss_record_step(self, step):
+        # the loss is stored every loss_record_interval steps, or never if it is 0 or None
+        return bool(self.loss_record_interval) and step % self.loss_record_interval == 0
+
+    def _run_train_step(self, sess, fetch_loss):
+        """ Run one step of the gradient descent process. If `fetch_loss` is True, the loss tensor is fetched
+            in the same session call as the train tensor, so the model graph is evaluated only once.
+
+            Returns:
+                The evaluated loss if `fetch_loss` is True, otherwise None.
+        """
+        if fetch_loss:
+            _, loss = sess.run([self.train_tensor, self.debug.loss_tensor])
+            return loss
+
+        sess.run(self.train_tensor)
+        return None
+
+    def _run_train_loop(self, sess, observed_names, examples):
+        """ Run the gradient descent process using the in-graph train loop, so each session call runs
+            `steps_per_loop` steps (or less, in the last call).
+
+            Returns:
+                A list with the losses to store in `debug.losses`.
+        """
+        num_steps, losses_tensor = self._get_train_loop_tensor(observed_names)
+
+        t = []
+        i = self.initial_epoch
+        converged = False
+        while i < self.epochs and not converged:
+            steps = min(self.steps_per_loop, self.epochs - i)
+            start = time.perf_counter()
+            losses = sess.run(losses_tensor, feed_dict={num_steps: steps})
+            # the time of each step is the mean time of the steps run in the loop
+            step_time = (time.perf_counter() - start) / steps
+
+            for step, loss in enumerate(losses, start=i):
+                if self._is_loss_record_step(step):
+                    t.append(loss)
+                if self.verbose and step % 200 == 0:
+                    print("\n {} epochs\t {}".format(step, loss), end="", flush=True)
+                if self.verbose and step % 10 == 0:
+                    print(".", end="", flush=True)
+                self.current_epoch = step + 1
+                self._end_step(step, step_time, examples, loss)
+                self._end_epoch(step, step_time, loss)
+                # the remaining steps of this loop have also been run, so the process stops at the end of the loop
+                converged = converged or self._is_converged(step, loss)
+            self._save_periodic_checkpoint(i, t)
+            i += steps
+
+        return t
+
+    def _get_train_loop_tensor(self, observed_names):
+        # the train loop depends on which variables are observed. Build it once for each set of observed variables
+        key = tuple(sorted(observed_names))
+        if key not in self._train_loops:
+            self._train_loops[key] = self._generate_train_loop_tensor(observed_names)
+        return self._train_loops[key]
+
+    def _generate_train_loop_tensor(self, observed_names):
+        """ This function creates a `tf.while_loop` which runs a number of steps of the gradient descent process.
+            In each iteration, the p and q models are expanded again inside the loop, reusing the tf.Variables of
+            the expanded parameters, so the samples and the parameter values are updated in every step.
+
+            Returns:
+                A tuple with the placeholder for the number of steps to run (`steps_per_loop` by default) and the
+                `tf.Tensor` with the loss of each step.
+        """
+        num_steps = tf.placeholder_with_default(self.steps_per_loop, shape=(), name="inferpy-train-loop-steps")
+        num_variables = len(tf.global_variables())
+
+        def body(i, losses):
+            # the same train operation as outside the loop, including the loss scaling if mixed_precision is True
+            loss_tensor, train = self._generate_train_op([self._generate_loop_loss_tensor(observed_names)])
+            with tf.control_dependencies([train]):
+                return i + 1, losses.write(i, loss_tensor)
+
+        _, losses = tf.while_loop(
+            lambda i, _: i < num_steps,
+            body,
+            [tf.constant(0), tf.TensorArray(self.debug.loss_tensor.dtype, size=num_steps)]
+        )
+
+        # variables cannot be created inside the loop, because they would be created in each iteration
+        if len(tf.global_variables()) != num_variables:
+            raise ValueError("steps_per_loop can only be used with models whose variables are named inf.Parameters.")
+
+        return num_steps, losses.stack()
+
+    def _generate_loop_loss_tensor(self, observed_names):
+        def replicate(num_replicas):
+            return [self._expand_loop_models(observed_names) for _ in range(num_replicas)]
+
+        pvars, qvars = self._expand_loop_models(observed_names)
+        return self.loss_fn(pvars, qvars, replicate=replicate, **self._loss_kwargs)
+
+    def _expand_loop_models(self, observed_names):
+        # the observed variables are intercepted with the observed_value tf.Variables from the expanded models
+        # (loaded by the observe context), and the hidden variables from the pmodel are intercepted with the qmodel ones
+        q_observed = {k: v.observed_value for k, v in self.expanded_variables["q"].items() if k in observed_names}
+        p_observed = {k: v.observed_value for k, v in self.expanded_variables["p"].items() if k in observed_names}
+        parameters = {k: p.var for k, p in itertools.chain(
+            self.expanded_parameters["p"].items(),
+            self.expanded_parameters["q"].items()
+        )}
+
+        # tf.Variables cannot be created inside the loop. Do not use conditions, and reuse the expanded parameters
+        with util.interceptor.disallow_conditions(), util.floatx_scope(self._get_compute_floatx()):
+            with contextmanager.parameter_reuse.reuse(parameters):
+                with ed.interception(util.interceptor.set_values(**q_observed)):
+                    qvars, _ = self.qmodel.expand_model(self.plate_size)
+                qvars = {k: v for k, v in qvars.items() if k not in observed_names}
+
+                with ed.interception(util.interceptor.set_values(**qvars, **p_observed)):
+                    pvars, _ = self.pmodel.expand_model(self.plate_size)
+
+        return pvars, qvars
+
+    def _expand_models(self, input_data):
+        with util.floatx_scope(self._get_compute_floatx()):
+            # expand de qmodel
+            with ed.interception(util.interceptor.set_values(**input_data)):
+                qvars, qparams = self.qmodel.expand_model(self.plate_size)
+
+            # expand de pmodel, using the intercept.set_values function, to include the sample_dict and the expanded
+            # qvars. The True first value enable to use tf.condition and observe RandomVariables modifying a
+            # tf.Variable value
+            with ed.interception(util.interceptor.set_values(**{**qvars, **input_data})):
+                pvars, pparams = self.pmodel.expand_model(self.plate_size)
+
+        return pvars, qvars, pparams, qparams
+
+    def _get_compute_floatx(self):
+        # the default float type used to expand the models, or None to use the current one
+        return "float16" if self.mixed_precision else None
+
+    def _get_compute_dtype(self, dtype):
+        # the dtype of the tensors in the expanded models, for tensors of the given dtype in the original models
+        return tf.float16 if self.mixed_precision and dtype.is_floating else dtype
+
+    def _generate_train_tensor(self, extra_loss_tensor, input_data=None, num_replicas=1, **kwargs):
         """ This function expand the p and q models. Then, it uses the  loss function to create the loss tensor
             and store it into the debug object as a new attribute.
             Then, uses the optimizer to create the train tensor used in the gradient descent iterative process.
             It store the expanded random variables and parameters from the p and q models in self.expanded_variables
             and self.expanded_parameters dicts.
 
+            If `input_data` is provided (a dict name: tensor), the observed variables are intercepted with these
+            tensors while the inference interceptors are enabled, so the data is read directly in the graph.
+
+            If `num_replicas` is greater than 1, the `input_data` tensors are split into `num_replicas` slices, each
+            one used by a replica of the expanded models sharing their variables. The gradients of the replicas are
+            averaged and applied once.
+
             Returns:
                 The `tf.Tensor` train tensor used in the gradient descent iterative process.
 
         """
         # expand the p and q models
-        # expand de qmodel
-        qvars, qparams = self.qmodel.expand_model(self.plate_size)
-
-        # expand de pmodel, using the intercept.set_values function, to include the sample_dict and the expanded qvars
-        # the True first value enable to use tf.condition and observe RandomVariables modifying a tf.Variable value
-        with ed.interception(util.interceptor.set_values(**qvars)):
-            pvars, pparams = self.pmodel.expand_model(self.plate_size)
+        if input_data is None:
+            input_data = {}
+        # the slice of the input data used by each replica
+        input_data_slices = {k: tf.split(v, num_replicas) for k, v in input_data.items()}
+        replicas_input_data = [{k: slices[r] for k, slices in input_data_slices.items()} for r in range(num_replicas)]
+
+        # names of the variables that exist before generating the train tensor
+        previous_variables = {v.name for v in tf.global_variables()}
+        # the values of a fitted inference object are read before creating any variable, so they cannot be modified
+        warm_start = self.warm_start.get_snapshot() if isinstance(self.warm_start, VI) else self.warm_start
+
+        # expand the models recording their variables, so they can be replicated sharing them
+        with contextmanager.shared_variables.record() as expanded_model_variables:
+            pvars, qvars, pparams, qparams = self._expand_models(replicas_input_data[0])
+
+        def make_replicate(replica_input_data):
+            def replicate(num_replicas):
+                # replicas of the expanded p and q models, used by loss functions which need several samples
+                replicas = []
+                for _ in range(num_replicas):
+                    with contextmanager.shared_variables.share(expanded_model_variables):
+                        replica_pvars, replica_qvars, _, _ = self._expand_models(replica_input_data)
+                    replicas.append((replica_pvars, replica_qvars))
+                return replicas
+            return replicate
+
+        # create the loss tensor of each replica
+        self._loss_kwargs = kwargs
+        loss_tensors = [self.loss_fn(pvars, qvars, replicate=make_replicate(replicas_input_data[0]), **kwargs)]
+        for replica_input_data in replicas_input_data[1:]:
+            with contextmanager.shared_variables.share(expanded_model_variables):
+                replica_pvars, replica_qvars, _, _ = self._expand_models(replica_input_data)
+            loss_tensors.append(self.loss_fn(replica_pvars, replica_qvars,
+                                             replicate=make_replicate(replica_input_data), **kwargs))
 
-        # create the loss tensor and trainable tensor for the gradient descent process
-        loss_tensor = self.loss_fn(pvars, qvars, **kwargs)
         # if extra_loss_tensor is not None, it must be a tensor with the inf.layers.Sequential losses
         if extra_loss_tensor is not None:
-            loss_tensor += extra_loss_tensor
-        # use the optimizer to create the train tensor
-        train = self.optimizer.minimize(loss_tensor)
+            loss_tensors = [loss_tensor + extra_loss_tensor for loss_tensor in loss_tensors]
 
         # save the expanded variables and parameters
         self.expanded_variables = {
@@ -172,10 +573,14 @@ class VI(Inference):
             "p": pparams,
             "q": qparams
         }
+
+        # use the optimizer to create the train tensor
+        loss_tensor, train = self._generate_train_op(loss_tensors)
         # save the loss tensor for debug purposes
         self.debug.loss_tensor = loss_tensor
 
-        # Initialize all variables which are not in the probmodel p, because they have been initialized before
+        # Initialize the variables created to train the models, but not the model parameters, because they have been
+        # initialized before. The variables of other inference objects in the graph keep their values
         model_variables = [v for v in itertools.chain(
             self.pmodel.params.values(),  # do not re-initialize prior p model parameters
             pparams.values(),  # do not re-initialize posterior p model parameters
@@ -184,7 +589,117 @@ class VI(Inference):
            )]
         inf.get_session().run(
             tf.variables_initializer([
-                v for v in tf.global_variables() if v not in model_variables and not v.name.startswith("inferpy-")
+                v for v in tf.global_variables() if v.name not in previous_variables and v not in model_variables
+                and not v.name.startswith("inferpy-")
                 ]))
 
+        # the variables of the expanded models, used to initialize them from a snapshot and to get the snapshots
+        self._model_variables = [v for v in expanded_model_variables if not v.name.startswith("inferpy-")]
+        if warm_start is not None:
+            self._load_snapshot(warm_start)
+
+        # the training state is composed of the variables created to train the models
+        self._saver = tf.train.Saver(var_list=[
+            v for v in tf.global_variables() if v.name not in previous_variables and not v.name.startswith("inferpy-")
+            ])
+        if self._pending_checkpoint is not None:
+            checkpoint, self._pending_checkpoint = self._pending_checkpoint, None
+            self.restore_checkpoint(checkpoint)
+
         return train
+
+    def _load_snapshot(self, snapshot):
+        # the snapshot can be obtained from another inference object or loaded from disk
+        if isinstance(snapshot, VI):
+            snapshot = snapshot.get_snapshot()
+        elif isinstance(snapshot, str):
+            snapshot = dict(np.load(snapshot))
+
+        sess = util.get_session()
+        for key, v in zip(_snapshot_keys(self._model_variables), self._model_variables):
+            if key in snapshot and v.shape.is_compatible_with(np.shape(snapshot[key])):
+                v.load(snapshot[key], session=sess)
+
+    def _generate_train_op(self, loss_tensors):
+        """ Uses the optimizer to create the operation which minimizes the loss tensor of each replica of the
+            expanded models. The gradients of the replicas are averaged and applied once.
+
+            Returns:
+                A tuple with the loss tensor (the mean of the replica losses) and the train operation.
+        """
+        if self.mixed_precision:
+            return self._generate_scaled_train_op(loss_tensors)
+
+        if len(loss_tensors) == 1:
+            return loss_tensors[0], self.optimizer.minimize(loss_tensors[0])
+
+        loss_tensor = tf.reduce_mean(loss_tensors)
+        train = self.optimizer.apply_gradients(_average_gradients(
+            [self.optimizer.compute_gradients(replica_loss_tensor) for replica_loss_tensor in loss_tensors]))
+        return loss_tensor, train
+
+    def _generate_scaled_train_op(self, loss_tensors, initial_scale=2. ** 15, increment_period=2000):
+        """ Creates the train operation using dynamic loss scaling. The loss is multiplied by a scale before
+            computing the gradients, so the small float16 gradients do not underflow, and the gradients are divided
+            by it before applying them. If any gradient is not finite, the step is skipped and the scale is halved.
+            The scale is doubled after `increment_period` steps with finite gradients.
+
+            Returns:
+                A tuple with the (unscaled) loss tensor and the train operation.
+        """
+        loss_tensor = tf.reduce_mean([tf.cast(replica_loss_tensor, tf.float32) for replica_loss_tensor in loss_tensors])
+
+        # the variables are created once, so the train loop uses them instead of creating them inside the loop
+        if self._loss_scale_variables is None:
+            self._loss_scale_variables = (tf.Variable(initial_scale, trainable=False, name="loss_scale"),
+                                          tf.Variable(0, trainable=False, name="loss_scale_finite_steps"))
+        loss_scale, finite_steps = self._loss_scale_variables
+
+        # the gradient of the mean loss is the average of the gradients of the replicas
+        grads_and_vars = [(_scale_gradient(g, 1. / loss_scale), v)
+                          for g, v in self.optimizer.compute_gradients(loss_tensor * loss_scale) if g is not None]
+        is_finite = tf.reduce_all([tf.reduce_all(tf.is_finite(
+            g.values if isinstance(g, tf.IndexedSlices) else g)) for g, _ in grads_and_vars])
+
+        # the variables are only updated if all the gradients are finite
+        apply = tf.cond(is_finite, lambda: self.optimizer.apply_gradients(grads_and_vars), tf.no_op)
+
+        with tf.control_dependencies([apply]):
+            steps = tf.where(is_finite, finite_steps + 1, tf.zeros_like(finite_steps))
+            increment = steps >= increment_period
+            new_scale = tf.where(is_finite,
+                                 tf.where(increment, loss_scale * 2., loss_scale),
+                                 tf.maximum(loss_scale / 2., 1.))
+            train = tf.group(loss_scale.assign(new_scale),
+                             finite_steps.assign(tf.where(increment, tf.zeros_like(steps), steps)))
+
+        return loss_tensor, train
+
+
+def _snapshot_keys(variables):
+    # the name of each variable without the suffixes added to make the names unique, and its occurrence number
+    occurrences = {}
+    keys = []
+    for v in variables:
+        name = "/".join(re.sub(r"_\d+$", "", part) for part in v.op.name.split("/"))
+        keys.append("{}:{}".format(name, occurrences.get(name, 0)))
+        occurrences[name] = occurrences.get(name, 0) + 1
+    return keys
+
+
+def _scale_gradient(gradient, scale):
+    # the gradients of gathered rows are tf.IndexedSlices, which cannot be multiplied directly
+    if isinstance(gradient, tf.IndexedSlices):
+        return tf.IndexedSlices(gradient.values * scale, gradient.indices, gradient.dense_shape)
+    return gradient * scale
+
+
+def _average_gradients(replicas_grads_and_vars):
+    # each element in replicas_grads_and_vars is the list of (gradient, variable) pairs computed by a replica,
+    # with the variables in the same order
+    averaged_grads_and_vars = []
+    for grads_and_vars in zip(*replicas_grads_and_vars):
+        grads = [tf.convert_to_tensor(g) for g, _ in grads_and_vars if g is not None]
+        averaged_grads_and_vars.append((tf.add_n(grads) / len(grads) if len(grads) > 0 else None,
+                                        grads_and_vars[0][1]))
+    return averaged_grads_and_vars
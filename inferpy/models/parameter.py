@@ -27,12 +27,15 @@ class Parameter:
     def __init__(self, initial_value, name=None):
         # By defult, parameter is not expanded
         self.is_datamodel = False
+        # the rows of the tf.Variable used as value, if it is a table with a row for each instance of the data
+        self.indices = None
 
         # the parameter must have a name
         self.name = name if name else util.name.generate('parameter')
 
         # convert parameter to tensor if it is not
         sanitized_initial_value = tf.convert_to_tensor(sanitize_input_arg(initial_value))
+        compute_dtype = sanitized_initial_value.dtype
 
         # check if Parameter is created inside a datamodel context or not.
         if contextmanager.data_model.is_active():
@@ -44,13 +47,39 @@ class Parameter:
 
             # check the sample_shape. If not empty, expand the sanitized_initial_value
             sample_shape = contextmanager.data_model.get_sample_shape(input_varname)
-            if sample_shape is not ():
+            if sample_shape != () and contextmanager.local_parameters.is_active():
+                # the tf.Variable is a table with a row for each instance of the data, and only some rows are used.
+                # The number of rows is fixed, so the datamodel size can be dynamic
+                self.indices = contextmanager.local_parameters.get_indices()
+                table_shape = tf.TensorShape(contextmanager.local_parameters.get_size())
+                sanitized_initial_value = tf.broadcast_to(sanitized_initial_value,
+                                                          table_shape.concatenate(sanitized_initial_value.shape))
+            elif contextmanager.data_model.is_dynamic(sample_shape):
+                # the tf.Variable needs a fixed number of rows, one for each instance of the data
+                raise ValueError("Parameters cannot be expanded with a dynamic datamodel size: {}".format(self.name))
+            elif sample_shape != ():
                 sanitized_initial_value = \
                     tf.broadcast_to(sanitized_initial_value, tf.TensorShape(sample_shape).concatenate(sanitized_initial_value.shape))
 
-        # Build the tf variable
-        self.var = tf.Variable(sanitized_initial_value, name=self.name)
-        util.session.get_session().run(tf.variables_initializer([self.var]))
+        # float16 parameters keep a float32 copy as tf.Variable (master weights), so small updates are not lost
+        if compute_dtype == tf.float16:
+            sanitized_initial_value = tf.cast(sanitized_initial_value, tf.float32)
+
+        # Build the tf variable, or use an existing one if the parameter is built inside a parameter_reuse context
+        reused_var = contextmanager.parameter_reuse.get_variable(self.name)
+        if reused_var is not None:
+            self.var = reused_var
+        else:
+            self.var = tf.Variable(sanitized_initial_value, name=self.name)
+            # a variable from a share context is already initialized, and it keeps its current value
+            if not contextmanager.shared_variables.is_shared(self.var):
+                util.session.get_session().run(tf.variables_initializer([self.var]))
+
+        # the value of the parameter. The gradients of the rows gathered from a table are sparse, so only these rows
+        # are updated by the optimizers
+        self.value = tf.gather(self.var, self.indices) if self.indices is not None else self.var
+        if compute_dtype != self.var.dtype.base_dtype:
+            self.value = tf.cast(self.value, compute_dtype)
 
         # register the variable, which is used to detect dependencies
         contextmanager.randvar_registry.register_parameter(self)
@@ -64,7 +93,7 @@ def _tensor_conversion_function(p, dtype=None, name=None, as_ref=False):
 
         If the variable needs to be broadcast_to, do it right now
     """
-    return tf.convert_to_tensor(p.var)
+    return tf.convert_to_tensor(p.value)
 
 
 # register the conversion function into a tensor
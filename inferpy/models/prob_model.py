@@ -41,7 +41,8 @@ def probmodel(builder):
         def fn():
             return builder(*args, **kwargs)
         return ProbModel(
-            builder=fn
+            builder=fn,
+            factory=(wrapper, args, kwargs)
         )
     return wrapper
 
@@ -54,9 +55,12 @@ class ProbModel:
     Random Variables/Parameters.
     """
 
-    def __init__(self, builder):
+    def __init__(self, builder, factory=None):
         # Initialize object attributes
         self.builder = builder
+        # the decorated function and the arguments used to create the model (if created with the probmodel
+        # decorator), which allow to create it again in other processes
+        self.factory = factory
         g_for_nxgraph = tf.Graph()
         # first buid the graph of dependencies
         with g_for_nxgraph.as_default():
@@ -200,6 +204,28 @@ class ProbModel:
         # If it works, set the observed variables
         self.observed_vars = data_loader.variables
 
+    @util.tf_run_ignored
+    def partial_fit(self, data):
+        """ Continue the inference with new data, reusing the inference method compiled by the `fit` function and
+            the current state of its variables (the expanded model is not re-built). The data must have the same
+            plate size than the data used to fit the model (or be processed in batches of the same size), unless the
+            inference method uses a dynamic plate size.
+        """
+        if self.inference_method is None:
+            raise RuntimeError("partial_fit cannot be used before using the fit function.")
+
+        data_loader = build_data_loader(data)
+
+        if len(data_loader.variables) == 0:
+            raise ValueError('The number of mapped variables must be at least 1.')
+
+        # run the update method of the already compiled inference method with the new data
+        with util.interceptor.enable_interceptor(*self.inference_method.get_interceptable_condition_variables()):
+            self.inference_method.update(data_loader)
+
+        # If it works, set the observed variables
+        self.observed_vars = data_loader.variables
+
     def expand_model(self, size=1):
         """ Create the expanded model vars using size as plate size and return the OrderedDict """
 
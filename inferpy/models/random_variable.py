@@ -343,12 +343,19 @@ def _make_random_variable(distribution_name):
             sample_shape = contextmanager.data_model.get_sample_shape(rv_name)
 
             # create tf.Variable's to allow to observe the Random Variable
-            shape = ([sample_shape] if sample_shape else []) + \
-                tfp_dist.batch_shape.as_list() + \
-                tfp_dist.event_shape.as_list()
+            if contextmanager.data_model.is_dynamic(sample_shape):
+                # the size of the datamodel is only known when running the graph: the shape is a tensor
+                shape = tf.concat([tf.reshape(sample_shape, [1]),
+                                   tf.constant(tfp_dist.batch_shape.as_list() + tfp_dist.event_shape.as_list(),
+                                               dtype=tf.int32)], axis=0)
+                initial_value = tf.zeros(shape, dtype=tfp_dist.dtype)
+            else:
+                shape = ([sample_shape] if sample_shape else []) + \
+                    tfp_dist.batch_shape.as_list() + \
+                    tfp_dist.event_shape.as_list()
 
-            # take into account the dtype of tfp_dist in order to create the initial value correctly
-            initial_value = tf.zeros(shape, dtype=tfp_dist.dtype) if shape else tf.constant(0,  dtype=tfp_dist.dtype)
+                # take into account the dtype of tfp_dist in order to create the initial value correctly
+                initial_value = tf.zeros(shape, dtype=tfp_dist.dtype) if shape else tf.constant(0, dtype=tfp_dist.dtype)
 
             # build the respective boolean and tf.Variables
             is_observed, observed_value = util.interceptor.make_predictable_variables(initial_value, rv_name)
@@ -7,7 +7,7 @@ useful for the main functionality provided by inferpy
 """
 
 
-from .common import floatx, set_floatx
+from .common import floatx, set_floatx, floatx_scope
 from .runtime import tf_run_allowed, tf_run_ignored, set_tf_run
 from . import iterables
 from . import interceptor
@@ -18,6 +18,7 @@ from .session import get_session, set_session, clear_session, new_session, init_
 __all__ = [
     'floatx',
     'set_floatx',
+    'floatx_scope',
     'iterables',
     'interceptor',
     'set_tf_run',
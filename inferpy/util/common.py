@@ -1,6 +1,7 @@
 """ Obtained from Keras GitHub repository: https://github.com/keras-team/keras/blob/master/keras/backend/common.py
 
 """
+from contextlib import contextmanager
 
 _FLOATX = "float32"
 
@@ -41,5 +42,22 @@ def set_floatx(floatx):
     _FLOATX = str(floatx)
 
 
+@contextmanager
+def floatx_scope(floatx):
+    """ Sets the default float type inside the context, and restores the previous one at the end.
+
+    Args:
+        floatx: String, 'float16', 'float32', or 'float64'. If None, the default float type is not changed.
+
+    """
+    previous_floatx = _FLOATX
+    if floatx is not None:
+        set_floatx(floatx)
+    try:
+        yield
+    finally:
+        set_floatx(previous_floatx)
+
+
 def is_float(dtype):
     return dtype == "float16" or dtype == "float32" or dtype == "float64"
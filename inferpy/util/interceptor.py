@@ -2,7 +2,7 @@ import tensorflow as tf
 from tensorflow_probability import edward2 as ed
 from contextlib import contextmanager
 from inferpy import util
-from inferpy.contextmanager import data_model
+from inferpy.contextmanager import data_model, shared_variables
 
 
 # Global variable to access when enable_interceptor is used. However, the vaiable will be None in the finally clause,
@@ -17,11 +17,13 @@ ALLOW_CONDITIONS = True
 @contextmanager
 def disallow_conditions():
     global ALLOW_CONDITIONS
+    # the contexts can be nested, so the previous value is restored
+    previous = ALLOW_CONDITIONS
     ALLOW_CONDITIONS = False
     try:
         yield
     finally:
-        ALLOW_CONDITIONS = True
+        ALLOW_CONDITIONS = previous
 
 
 @contextmanager
@@ -89,7 +91,7 @@ def set_values(**model_kwargs):  # noqa: E999
                 )
 
                 # need to broadcast to fix the shape of the tensor (which always be _value.shape)
-                kwargs['value'] = tf.broadcast_to(conditional_value, _value.shape)
+                kwargs['value'] = tf.broadcast_to(conditional_value, _shape_of(_value))
             else:
                 kwargs['value'] = interception_value
 
@@ -124,7 +126,7 @@ def set_values_condition(var_condition, var_value):
             )
 
             # need to broadcast to fix the shape of the tensor (which always be _value.shape)
-            return ed.interceptable(f)(*args, value=tf.broadcast_to(conditional_value, _value.shape), **kwargs)
+            return ed.interceptable(f)(*args, value=tf.broadcast_to(conditional_value, _shape_of(_value)), **kwargs)
         else:
             return ed.interceptable(f)(*args, **kwargs)
 
@@ -136,11 +138,20 @@ def make_predictable_variables(initial_value, rv_name):
         is_observed = tf.Variable(False, trainable=False,
                                   name="inferpy-predict-enabled-{name}".format(name=rv_name or "default"))
 
+        # if the shape is not fully defined (i.e. dynamic datamodel size), values of any size can be observed
         observed_value = tf.Variable(initial_value, trainable=False,
+                                     validate_shape=initial_value.shape.is_fully_defined(),
                                      name="inferpy-predict-{name}".format(name=rv_name or "default"))
 
-        util.session.get_session().run(tf.variables_initializer([is_observed, observed_value]))
+        # the variables from a share context are already initialized, and they keep the observed values
+        util.session.get_session().run(tf.variables_initializer(
+            [v for v in (is_observed, observed_value) if not shared_variables.is_shared(v)]))
 
         return is_observed, observed_value
     else:
         return None, None
+
+
+def _shape_of(value):
+    # the static shape if it is fully defined, otherwise (i.e. dynamic datamodel size) the shape as a tensor
+    return value.shape if value.shape.is_fully_defined() else tf.shape(value)
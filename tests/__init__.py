@@ -1,6 +1,25 @@
 from contextlib import contextmanager
 
+import tensorflow as tf
+
+import inferpy as inf
+
 
 @contextmanager
 def no_raised_exc():
     yield
+
+
+# model with a global hidden variable, and its q model, used in the inference tests
+@inf.probmodel
+def normal_model():
+    mu = inf.Normal(0., 1., name='mu')
+    with inf.datamodel():
+        inf.Normal(mu, 1., name='x')
+
+
+@inf.probmodel
+def normal_qmodel():
+    qmu_loc = inf.Parameter(0., name='qmu_loc')
+    qmu_scale = tf.math.softplus(inf.Parameter(1., name='qmu_scale'))
+    inf.Normal(qmu_loc, qmu_scale, name='mu')
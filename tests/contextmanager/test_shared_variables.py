@@ -0,0 +1,44 @@
+import pytest
+
+import inferpy as inf
+from inferpy.contextmanager import shared_variables
+
+
+@inf.probmodel
+def model():
+    mu = inf.Normal(inf.Parameter(0., name='mu_loc'), 1., name='mu')
+    with inf.datamodel():
+        inf.Normal(mu, 1., name='x')
+
+
+def test_share():
+    m = model()
+    with shared_variables.record() as variables:
+        expanded_vars, expanded_params = m.expand_model(10)
+
+    # change the values of the recorded parameter and observed flag
+    sess = inf.get_session()
+    expanded_params['mu_loc'].var.load(2., session=sess)
+    expanded_vars['x'].is_observed.load(True, session=sess)
+
+    # the replica uses the same tf.Variables, which are not initialized again
+    with shared_variables.share(variables):
+        replica_vars, replica_params = m.expand_model(10)
+    assert replica_params['mu_loc'].var is expanded_params['mu_loc'].var
+    assert replica_vars['x'].is_observed is expanded_vars['x'].is_observed
+    assert sess.run(expanded_params['mu_loc'].var) == 2.
+    assert sess.run(expanded_vars['x'].is_observed)
+
+    # the variables are only shared inside the context
+    assert not shared_variables.is_shared(expanded_params['mu_loc'].var)
+
+
+def test_share_more_variables():
+    m = model()
+    with shared_variables.record() as variables:
+        m.expand_model(10)
+
+    # the model creates more variables than the recorded ones
+    with pytest.raises(RuntimeError):
+        with shared_variables.share(variables[:1]):
+            m.expand_model(10)
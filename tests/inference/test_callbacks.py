@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import inferpy as inf
+from inferpy.inference import Callback, MetricsBuffer
+from tests import normal_model, normal_qmodel
+
+
+def test_metrics_buffer():
+    metrics = MetricsBuffer(capacity=2)
+    metrics.record(1., 0.5, 10)
+    metrics.record(None, 0.25, 10)
+    # the array is grown when it is full
+    metrics.record(3., 0.5, 20)
+
+    assert len(metrics) == 3
+    assert np.array_equal(metrics.loss, [1., np.nan, 3.], equal_nan=True)
+    assert np.array_equal(metrics.step_time, [0.5, 0.25, 0.5])
+    assert np.array_equal(metrics.examples_per_sec, [20., 40., 40.])
+
+    metrics.clear()
+    assert len(metrics) == 0
+
+
+def test_wrong_batch_interval():
+    with pytest.raises(ValueError):
+        Callback(batch_interval=0)
+
+
+class CountCallback(Callback):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches = []
+        self.epochs = []
+
+    def on_batch_end(self, step, logs):
+        self.batches.append(step)
+
+    def on_epoch_end(self, epoch, logs):
+        self.epochs.append(epoch)
+
+
+def test_callbacks():
+    callback = CountCallback(batch_interval=2)
+    method = inf.inference.SVI(normal_qmodel(), epochs=3, batch_size=10, loss_record_interval=None,
+                               callbacks=[callback], verbose=False)
+    normal_model().fit({'x': np.ones(50)}, method)
+
+    # 5 batches per epoch
+    assert callback.batches == list(range(0, 15, 2))
+    assert callback.epochs == [0, 1, 2]
+    # the loss is never evaluated, but the step times are recorded
+    assert len(method.metrics) == 15
+    assert np.all(np.isnan(method.metrics.loss))
+    assert np.all(method.metrics.step_time > 0)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+import inferpy as inf
+from inferpy.inference import EarlyStopping
+from tests import normal_model, normal_qmodel
+
+
+def test_converged():
+    early_stopping = EarlyStopping(tolerance=1e-3, patience=3)
+    # a constant loss converges after `patience` epochs without improvement (the first one initializes the average)
+    assert [early_stopping.update(100.) for _ in range(4)] == [False, False, False, True]
+
+
+def test_not_converged():
+    early_stopping = EarlyStopping(tolerance=1e-3, patience=3)
+    # the loss keeps decreasing
+    assert not any(early_stopping.update(100. / (i + 1)) for i in range(20))
+
+
+def test_reset():
+    early_stopping = EarlyStopping(tolerance=1e-3, patience=2)
+    for _ in range(3):
+        early_stopping.update(100.)
+    early_stopping.reset()
+    assert early_stopping.smoothed_loss is None
+    assert early_stopping.wait == 0
+    assert not early_stopping.update(100.)
+
+
+@pytest.mark.parametrize("args", [
+    dict(tolerance=-1.),
+    dict(patience=0),
+    dict(smoothing=1.),
+])
+def test_wrong_arguments(args):
+    with pytest.raises(ValueError):
+        EarlyStopping(**args)
+
+
+def test_converged_in_train_loop():
+    # any relative change of the loss is lower than the tolerance, so it converges in the second epoch
+    vi = inf.inference.VI(normal_qmodel(), epochs=100, steps_per_loop=10, verbose=False,
+                          early_stopping=EarlyStopping(tolerance=1e6, patience=1))
+    normal_model().fit({'x': np.ones(50)}, vi)
+
+    # the remaining steps of the first loop have been run
+    assert vi.stopped_epoch == 1
+    assert vi.current_epoch == 10
+    assert len(vi.metrics) == 10
@@ -0,0 +1,161 @@
+import functools
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import inferpy as inf
+from inferpy import contextmanager
+from inferpy.inference.variational.loss_functions import ELBO, IWELBO
+from tests import normal_model
+
+
+@inf.probmodel
+def model():
+    mu = inf.Normal(0., 1., name='mu')
+    with inf.datamodel():
+        z = inf.Normal(mu, 1., name='z')
+        inf.Normal(z, 1., name='x')
+
+
+@inf.probmodel
+def qmodel():
+    qmu = inf.Normal(inf.Parameter(0., name='qmu_loc'), tf.math.softplus(inf.Parameter(1., name='qmu_scale')),
+                     name='mu')
+    with inf.datamodel():
+        inf.Normal(qmu, 1., name='z')
+
+
+@inf.probmodel
+def local_qmodel():
+    with inf.datamodel():
+        inf.Normal(inf.Parameter(0., name='qz_loc'), 1., name='z')
+
+
+@pytest.mark.parametrize("inference_method", [
+    lambda q: inf.inference.VI(q, loss='IWELBO', epochs=10),
+    lambda q: inf.inference.VI(q, loss=functools.partial(IWELBO, num_samples=3), epochs=10, steps_per_loop=5),
+    lambda q: inf.inference.SVI(q, loss='IWELBO', epochs=10, batch_size=10),
+])
+@pytest.mark.parametrize("q", [qmodel, local_qmodel])
+def test_iwelbo(inference_method, q):
+    m = model()
+    method = inference_method(q())
+    m.fit({'x': np.ones(50)}, method)
+    assert len(method.losses) > 0
+    assert np.all(np.isfinite(method.losses))
+
+
+@pytest.mark.parametrize("inference_method", [
+    lambda q: inf.inference.VI(q, loss=functools.partial(ELBO, num_particles=3), epochs=10),
+    lambda q: inf.inference.VI(q, loss=functools.partial(ELBO, num_particles=3), epochs=10, steps_per_loop=5),
+    lambda q: inf.inference.SVI(q, loss=functools.partial(ELBO, num_particles=3), epochs=10, batch_size=10),
+])
+def test_elbo_num_particles(inference_method):
+    m = model()
+    method = inference_method(qmodel())
+    m.fit({'x': np.ones(50)}, method)
+    assert np.all(np.isfinite(method.losses))
+
+
+def test_elbo_num_particles_without_replicate():
+    pvars, qvars = expand_models(normal_model(), normal_qmodel(), {'x': np.ones(10)})
+    with pytest.raises(ValueError):
+        ELBO(pvars, qvars, num_particles=2)
+
+
+@inf.probmodel
+def normal_qmodel():
+    inf.Normal(inf.Parameter(0.5, name='qmu_loc'), tf.math.softplus(inf.Parameter(1., name='qmu_scale')), name='mu')
+
+
+@inf.probmodel
+def laplace_qmodel():
+    inf.Laplace(inf.Parameter(0.5, name='qmu_loc'), tf.math.softplus(inf.Parameter(1., name='qmu_scale')), name='mu')
+
+
+@inf.probmodel
+def local_model():
+    with inf.datamodel():
+        z = inf.Normal(0., 1., name='z')
+        inf.Normal(z, 1., name='x')
+
+
+@inf.probmodel
+def local_normal_qmodel():
+    with inf.datamodel():
+        inf.Normal(inf.Parameter(0.5, name='qz_loc'), 1., name='z')
+
+
+def expand_models(p, q, data):
+    # the models are expanded by the inference method, but no step of the gradient descent process is run
+    vi = inf.inference.VI(q, epochs=0, verbose=False)
+    p.fit(data, vi)
+    return vi.expanded_variables['p'], vi.expanded_variables['q']
+
+
+def normal_log_prob(x, loc, scale):
+    return -0.5 * np.log(2 * np.pi) - np.log(scale) - 0.5 * ((x - loc) / scale) ** 2
+
+
+def sum_log_prob(rv):
+    return tf.reduce_sum(rv.log_prob(rv.value))
+
+
+def test_elbo_analytic_kl():
+    data = {'x': np.ones(10)}
+    pvars, qvars = expand_models(normal_model(), normal_qmodel(), data)
+    loss = ELBO(pvars, qvars)
+    sess = inf.get_session()
+
+    # KL(N(0.5, softplus(1)) || N(0, 1))
+    scale = np.log1p(np.exp(1.))
+    kl = - np.log(scale) + (scale ** 2 + 0.5 ** 2) / 2 - 0.5
+
+    # the loss is minus the energy plus the KL divergence, which is computed exactly, so it does not depend on the
+    # sample of mu
+    with contextmanager.observe(pvars, data):
+        for _ in range(3):
+            loss_value, energy = sess.run([loss, sum_log_prob(pvars['x'])])
+            assert np.isclose(loss_value, - energy + kl, rtol=1e-4)
+
+
+@pytest.mark.parametrize("q, analytic_kl", [
+    (normal_qmodel, False),
+    (laplace_qmodel, True),  # there is no closed form of KL(Laplace || Normal)
+])
+def test_elbo_sampled_kl(q, analytic_kl):
+    data = {'x': np.ones(10)}
+    pvars, qvars = expand_models(normal_model(), q(), data)
+    loss = ELBO(pvars, qvars, analytic_kl=analytic_kl)
+    sess = inf.get_session()
+
+    # the KL divergence is estimated with the sampled log probs of mu
+    with contextmanager.observe(pvars, data):
+        values = [sess.run([loss, sum_log_prob(pvars['x']), sum_log_prob(pvars['mu']), sum_log_prob(qvars['mu'])])
+                  for _ in range(3)]
+    for loss_value, energy, p_log_prob, q_log_prob in values:
+        assert np.isclose(loss_value, - energy - p_log_prob + q_log_prob, rtol=1e-4)
+    assert len(set(np.round([energy + loss_value for loss_value, energy, _, _ in values], 4))) > 1
+
+
+def test_elbo_analytic_kl_batch_weight():
+    data = {'x': np.ones(10)}
+    pvars, qvars = expand_models(local_model(), local_normal_qmodel(), data)
+    sess = inf.get_session()
+
+    # the analytic KL of the local hidden variables is scaled by the batch_weight, as the energy
+    with contextmanager.observe(pvars, data):
+        loss, weighted_loss = sess.run([ELBO(pvars, qvars), ELBO(pvars, qvars, batch_weight=3.)])
+    assert np.isclose(weighted_loss, 3. * loss, rtol=1e-4)
+
+
+def test_elbo_analytic_kl_observed():
+    data = {'x': np.ones(10), 'z': np.full(10, 0.5)}
+    pvars, qvars = expand_models(local_model(), local_normal_qmodel(), {'x': data['x']})
+    loss = ELBO(pvars, qvars)
+
+    # if z is observed, the analytic term of z is its energy instead of minus the KL divergence
+    with contextmanager.observe(pvars, data), contextmanager.observe(qvars, data):
+        loss_value = inf.get_session().run(loss)
+    energy = 10 * (normal_log_prob(1., 0.5, 1.) + normal_log_prob(0.5, 0., 1.))
+    assert np.isclose(loss_value, - energy, rtol=1e-4)
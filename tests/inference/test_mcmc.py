@@ -0,0 +1,214 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import inferpy as inf
+from tests import normal_model, normal_qmodel
+
+
+def test_multiple_chains():
+    m = normal_model()
+    mcmc = inf.inference.MCMC(num_burnin_steps=20, num_results=50, num_chains=4)
+    m.fit({'x': np.ones(20)}, mcmc)
+
+    # the diagnostics are computed for each hidden variable
+    assert set(mcmc.rhat.keys()) == {'mu'}
+    assert set(mcmc.ess.keys()) == {'mu'}
+    assert np.isfinite(mcmc.rhat['mu'])
+    assert mcmc.ess['mu'] > 0
+
+    # the draws of all the chains are used as posterior samples
+    assert mcmc.states['mu'].distribution.samples.shape == (200, )
+
+
+def test_single_chain():
+    m = normal_model()
+    mcmc = inf.inference.MCMC(num_burnin_steps=20, num_results=50)
+    m.fit({'x': np.ones(20)}, mcmc)
+
+    assert mcmc.rhat is None
+    assert mcmc.ess['mu'] > 0
+
+
+def test_wrong_num_chains():
+    with pytest.raises(ValueError):
+        inf.inference.MCMC(num_chains=0)
+
+
+def test_adapt_step_size():
+    m = normal_model()
+    mcmc = inf.inference.MCMC(step_size=1., num_burnin_steps=50, num_results=50, adapt_step_size=True)
+    m.fit({'x': np.ones(20)}, mcmc)
+
+    # the step size is reduced from a too large initial value
+    assert 0 < np.max(mcmc.adapted_step_size) < 1.
+    assert mcmc.states['mu'].distribution.samples.shape == (50, )
+
+
+def test_model_expanded_once():
+    builds = []
+
+    @inf.probmodel
+    def counted_model():
+        builds.append(1)
+        mu = inf.Normal(0., 1., name='mu')
+        with inf.datamodel():
+            inf.Normal(mu, 1., name='x')
+
+    # the number of times the model is built does not depend on the number of traces of the log prob
+    num_builds = []
+    for num_chains in [1, 3]:
+        m = counted_model()
+        del builds[:]
+        m.fit({'x': np.ones(20)}, inf.inference.MCMC(num_burnin_steps=10, num_results=10, num_chains=num_chains))
+        num_builds.append(len(builds))
+
+    assert num_builds[0] == num_builds[1]
+
+
+@inf.probmodel
+def large_model():
+    mu = inf.Normal(0., 1., name='mu')
+    with inf.datamodel():
+        inf.Normal(mu, 1., name='x')
+        inf.Normal(2. * mu + 1., tf.math.softplus(mu) + 1., name='y')
+        inf.StudentT(3., tf.square(mu), 1., name='t')
+
+
+@pytest.mark.parametrize("num_chains", [1, 3])
+def test_log_prob_defined_once(num_chains):
+    # the number of ops added in each trace of the log prob does not depend on the size of the model
+    num_ops = []
+    for m, data in [(normal_model(), {'x': np.ones(20)}),
+                    (large_model(), {'x': np.ones(20), 'y': np.ones(20), 't': np.ones(20)})]:
+        mcmc = inf.inference.MCMC(num_burnin_steps=10, num_results=10, num_chains=num_chains)
+        m.fit(data, mcmc)
+
+        graph = tf.get_default_graph()
+        state = tf.zeros([num_chains] if num_chains > 1 else [])
+        for _ in range(2):
+            previous_ops = len(graph.get_operations())
+            mcmc._target_log_prob_fn(state)
+            num_ops.append(len(graph.get_operations()) - previous_ops)
+
+    assert len(set(num_ops)) == 1
+
+
+@inf.probmodel
+def local_model():
+    mu = inf.Normal(0., 1., name='mu')
+    with inf.datamodel():
+        z = inf.Normal(mu, 1., name='z')
+        inf.Normal(z, 1., name='x')
+
+
+def test_thinning_and_retain():
+    m = local_model()
+    mcmc = inf.inference.MCMC(num_burnin_steps=10, num_results=30, num_steps_between_results=2, retain=['mu'])
+    m.fit({'x': np.ones(20)}, mcmc)
+
+    assert set(mcmc.states.keys()) == {'mu'}
+    assert set(mcmc.ess.keys()) == {'mu'}
+    assert mcmc.states['mu'].distribution.samples.shape == (30, )
+
+
+def test_wrong_retain():
+    m = local_model()
+    with pytest.raises(ValueError):
+        m.fit({'x': np.ones(20)}, inf.inference.MCMC(num_burnin_steps=10, num_results=10, retain=['x']))
+
+
+@pytest.mark.parametrize("num_chains", [1, 2])
+def test_chunks_and_spill(tmp_path, num_chains):
+    m = local_model()
+    mcmc = inf.inference.MCMC(num_burnin_steps=10, num_results=25, num_chains=num_chains, chunk_size=10,
+                              spill_dir=str(tmp_path))
+    m.fit({'x': np.ones(20)}, mcmc)
+
+    # the draws of each variable are written in its own file
+    draws = np.load(str(tmp_path / 'z.npy'), mmap_mode='r')
+    assert draws.shape == ((25, 20) if num_chains == 1 else (25, num_chains, 20))
+    assert np.all(np.isfinite(draws))
+
+    # the queries read the draws from the files
+    sample = mcmc.posterior('z').sample()
+    assert sample.shape == (20, )
+    assert np.any(np.all(np.reshape(draws, (-1, 20)) == sample, axis=1))
+
+
+def test_diagnostics_do_not_load_spilled_draws(tmp_path, monkeypatch):
+    from inferpy.inference import mcmc as mcmc_module
+    monkeypatch.setattr(mcmc_module, '_DIAGNOSTICS_CHUNK_SIZE', 100)
+
+    # record the size of the largest array fed in a session call
+    fed_sizes = []
+    run = tf.Session.run
+
+    def recording_run(self, fetches, feed_dict=None, **kwargs):
+        fed_sizes.extend(np.size(v) for v in (feed_dict or {}).values())
+        return run(self, fetches, feed_dict=feed_dict, **kwargs)
+
+    monkeypatch.setattr(tf.Session, 'run', recording_run)
+
+    m = local_model()
+    mcmc = inf.inference.MCMC(num_burnin_steps=10, num_results=25, num_chains=2, chunk_size=10,
+                              spill_dir=str(tmp_path))
+    m.fit({'x': np.ones(20)}, mcmc)
+
+    # the draws of z have 25 * 2 * 20 values, but the diagnostics are computed in slices of 100 values
+    assert mcmc.ess['z'].shape == (20, )
+    assert mcmc.rhat['z'].shape == (20, )
+    assert np.all(np.isfinite(mcmc.rhat['z']))
+    assert max(fed_sizes) <= 100
+
+
+def test_parallel_chains():
+    m = normal_model()
+    mcmc = inf.inference.MCMC(num_burnin_steps=20, num_results=50, num_chains=2, num_workers=2)
+    m.fit({'x': np.ones(20)}, mcmc)
+
+    # the draws of the chains run in the worker processes are merged
+    assert mcmc.states['mu'].distribution.samples.shape == (100, )
+    assert np.isfinite(mcmc.rhat['mu'])
+    assert mcmc.ess['mu'] > 0
+
+
+def test_wrong_num_workers():
+    with pytest.raises(ValueError):
+        inf.inference.MCMC(num_workers=0)
+
+
+@pytest.mark.parametrize("use_query", [False, True])
+def test_init_from(use_query):
+    m = normal_model()
+    vi = inf.inference.VI(normal_qmodel(), epochs=500, verbose=False)
+    m.fit({'x': np.full(50, 2.)}, vi)
+
+    # the chains start from the posterior, so a short burn-in is enough
+    mcmc = inf.inference.MCMC(step_size=0.5, num_burnin_steps=10, num_results=50, num_chains=2,
+                              init_from=vi.posterior() if use_query else vi)
+    m.fit({'x': np.full(50, 2.)}, mcmc)
+
+    assert np.abs(np.mean(mcmc.states['mu'].distribution.samples) - 2.) < 0.5
+
+
+def test_init_from_with_workers():
+    with pytest.raises(ValueError):
+        inf.inference.MCMC(num_workers=2, init_from={})
+
+
+def test_posterior_predictive_samples():
+    m = normal_model()
+    mcmc = inf.inference.MCMC(num_burnin_steps=20, num_results=40)
+    m.fit({'x': np.full(20, 2.)}, mcmc)
+
+    # a predictive sample of the datamodel for each posterior draw
+    samples = mcmc.posterior_predictive_samples('x')
+    assert samples['x'].shape == (40, 20)
+    samples = mcmc.posterior_predictive_samples('x', num_draws=10)
+    assert samples['x'].shape == (10, 20)
+
+    summary = mcmc.posterior_predictive_summary('x', quantiles=(0.1, 0.9))
+    assert summary['x']['mean'].shape == (20, )
+    assert summary['x']['quantiles'].shape == (2, 20)
+    assert np.all(summary['x']['quantiles'][0] <= summary['x']['quantiles'][1])
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import inferpy as inf
+from tests import normal_model, normal_qmodel
+
+
+def test_conjugate_update():
+    N = 100
+    m = normal_model()
+    method = inf.inference.NaturalGradientSVI(normal_qmodel(), epochs=1, batch_size=N)
+    m.fit({'x': np.ones(N)}, method)
+
+    assert method.conjugate_variables == ['mu']
+
+    # the first step size is 1, so the q variable is the exact posterior after a step with all the data
+    sess = inf.get_session()
+    qparams = method.expanded_parameters['q']
+    assert np.isclose(sess.run(qparams['qmu_loc'].var), N / (N + 1), atol=1e-4)
+    assert np.isclose(sess.run(tf.math.softplus(qparams['qmu_scale'].var)), np.sqrt(1 / (N + 1)), atol=1e-4)
+
+
+def test_natural_parameters_update():
+    N = 100
+    delay, kappa, steps = 2., 0.7, 3
+    m = normal_model()
+    method = inf.inference.NaturalGradientSVI(normal_qmodel(), epochs=steps, batch_size=N, learning_rate_delay=delay,
+                                              forgetting_rate=kappa)
+    m.fit({'x': np.ones(N)}, method)
+
+    # the steps are done in the natural parameters space, starting from the initial values of the Parameters
+    eta = np.array([0., -0.5 / np.log1p(np.exp(1.)) ** 2])
+    target = np.array([N, -0.5 * (N + 1)])
+    for t in range(steps):
+        rho = (t + delay) ** -kappa
+        eta = (1 - rho) * eta + rho * target
+
+    sess = inf.get_session()
+    qparams = method.expanded_parameters['q']
+    assert np.isclose(sess.run(qparams['qmu_loc'].var), -0.5 * eta[0] / eta[1], atol=1e-4)
+    assert np.isclose(sess.run(tf.math.softplus(qparams['qmu_scale'].var)), np.sqrt(-0.5 / eta[1]), atol=1e-4)
+
+
+def test_non_conjugate_fallback():
+    @inf.probmodel
+    def non_conjugate_model():
+        mu = inf.Normal(0., 1., name='mu')
+        with inf.datamodel():
+            inf.Normal(tf.exp(mu), 1., name='x')
+
+    m = non_conjugate_model()
+    method = inf.inference.NaturalGradientSVI(normal_qmodel(), epochs=10, batch_size=10)
+    m.fit({'x': np.ones(100)}, method)
+
+    # the variable is not a conjugate pair, so it is updated by the optimizer
+    assert method.conjugate_variables == []
+    assert len(method.losses) == 100
+
+
+@pytest.mark.parametrize("args", [
+    dict(num_replicas=2),
+    dict(mixed_precision=True),
+])
+def test_wrong_arguments(args):
+    with pytest.raises(ValueError):
+        inf.inference.NaturalGradientSVI(normal_qmodel(), batch_size=10, **args)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import inferpy as inf
+from inferpy.data.loaders import CsvLoader
+from tests import normal_model
+
+
+@pytest.mark.parametrize("method", ["sgld", "sghmc"])
+def test_sgmcmc(method):
+    m = normal_model()
+    sgmcmc = inf.inference.SGMCMC(method=method, step_size=1e-3, batch_size=10, num_burnin_steps=200,
+                                  num_results=100, num_steps_between_results=1)
+    m.fit({'x': np.random.normal(2., 1., 200).astype(np.float32)}, sgmcmc)
+
+    samples = m.posterior('mu').sample(50)
+    assert samples.shape == (50, )
+    # the posterior of mu is close to the mean of the data
+    assert np.abs(np.mean(sgmcmc.states['mu'].distribution.samples) - 2.) < 0.5
+
+    # the chain is not trainable, so it is not updated by the optimizers of other inference methods in the graph
+    assert not any(v.name.startswith('inferpy-sgmcmc') for v in tf.trainable_variables())
+
+
+def test_partial_fit():
+    m = normal_model()
+    sgmcmc = inf.inference.SGMCMC(step_size=1e-3, batch_size=10, num_burnin_steps=10, num_results=10)
+    m.fit({'x': np.ones(50)}, sgmcmc)
+    assert inf.get_session().run(sgmcmc.batch_weight) == 5
+
+    # the batch_weight is computed for the size of the data used in each update
+    m.partial_fit({'x': np.ones(100)})
+    assert inf.get_session().run(sgmcmc.batch_weight) == 10
+    assert sgmcmc.states['mu'].distribution.samples.shape == (10, )
+
+
+def test_csv_loader(tmp_path):
+    # the first column of the file is the index of the instances
+    path = str(tmp_path / 'data.csv')
+    data = np.stack([np.arange(100), np.random.normal(2., 1., 100)], axis=1)
+    np.savetxt(path, data, delimiter=',', header=',x', comments='')
+
+    m = normal_model()
+    sgmcmc = inf.inference.SGMCMC(step_size=1e-3, batch_size=10, num_burnin_steps=50, num_results=20)
+    m.fit(CsvLoader(path, has_header=True), sgmcmc)
+
+    assert sgmcmc.states['mu'].distribution.samples.shape == (20, )
+
+
+def test_local_hidden():
+    @inf.probmodel
+    def local_model():
+        mu = inf.Normal(0., 1., name='mu')
+        with inf.datamodel():
+            z = inf.Normal(mu, 1., name='z')
+            inf.Normal(z, 1., name='x')
+
+    m = local_model()
+    with pytest.raises(ValueError):
+        m.fit({'x': np.ones(20)}, inf.inference.SGMCMC(batch_size=10))
+
+
+def test_wrong_method():
+    with pytest.raises(ValueError):
+        inf.inference.SGMCMC(method="hmc")
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import inferpy as inf
+from tests import normal_model, normal_qmodel
+
+
+@inf.probmodel
+def model():
+    with inf.datamodel():
+        z = inf.Normal(0., 1., name='z')
+        inf.Normal(z, 1., name='x')
+
+
+@inf.probmodel
+def qmodel():
+    with inf.datamodel():
+        qz_loc = inf.Parameter(0., name='qz_loc')
+        inf.Normal(qz_loc, 1., name='z')
+
+
+def test_sparse_local_parameters():
+    N = 50
+    m = model()
+    method = inf.inference.SVI(qmodel(), epochs=5, batch_size=10, sparse_local_parameters=True,
+                               optimizer=tf.train.GradientDescentOptimizer(0.1))
+    m.fit({'x': 10. + np.arange(N, dtype=np.float32)}, method)
+
+    # the local parameter is a table with a row for each instance, and all of them have been updated
+    table = inf.get_session().run(method.expanded_parameters['q']['qz_loc'].var)
+    assert table.shape == (N, )
+    assert np.all(table != 0.)
+
+    # the data must have as many instances as rows in the table
+    with pytest.raises(ValueError):
+        m.partial_fit({'x': np.ones(2 * N)})
+
+
+def test_sparse_local_parameters_dynamic_plate():
+    N = 55
+    m = model()
+    method = inf.inference.SVI(qmodel(), epochs=5, batch_size=10, sparse_local_parameters=True, dynamic_plate=True,
+                               optimizer=tf.train.GradientDescentOptimizer(0.1))
+    m.fit({'x': 10. + np.arange(N, dtype=np.float32)}, method)
+
+    # the table has a fixed number of rows, and the rows of the ragged last batch are also updated
+    table = inf.get_session().run(method.expanded_parameters['q']['qz_loc'].var)
+    assert table.shape == (N, )
+    assert np.all(table != 0.)
+
+
+def test_sparse_local_parameters_direct_input():
+    with pytest.raises(ValueError):
+        inf.inference.SVI(qmodel(), direct_input=True, sparse_local_parameters=True)
+
+
+def test_num_replicas():
+    m = normal_model()
+    method = inf.inference.SVI(normal_qmodel(), epochs=10, batch_size=10, num_replicas=2)
+    m.fit({'x': np.full(50, 3.)}, method)
+
+    # each replica processes half of the batch, and the gradients of both of them update the shared parameters
+    assert method.plate_size == 5
+    assert np.all(np.isfinite(method.losses))
+    assert method.get_snapshot()['qmu_loc:0'] > 0.
+
+
+def test_wrong_num_replicas():
+    # the batch must be split into slices of the same size
+    with pytest.raises(ValueError):
+        inf.inference.SVI(normal_qmodel(), batch_size=10, num_replicas=3)
+
+
+def test_direct_input():
+    N = 50
+    data = np.arange(N, dtype=np.float32)
+    m = normal_model()
+    method = inf.inference.SVI(normal_qmodel(), epochs=10, batch_size=10, direct_input=True)
+    m.fit({'x': data}, method)
+    train_tensor = method.train_tensor
+
+    assert np.all(np.isfinite(method.losses))
+    assert method.get_snapshot()['qmu_loc:0'] > 0.
+
+    # the observed variables of the expanded models are read from the iterator, so each evaluation gets a batch
+    batch = inf.get_session().run(method.expanded_variables['p']['x'])
+    assert batch.shape == (10, )
+    assert np.all(np.isin(batch, data))
+
+    # the iterator is initialized with the new data, and the train tensor is reused
+    m.partial_fit({'x': data})
+    assert method.train_tensor is train_tensor
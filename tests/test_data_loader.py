@@ -225,4 +225,25 @@ def test_build_data_loader(data, expected_size, expected_type, exp_keys):
     assert set(data_loader.variables) == set(exp_keys)
 
 
-
+@pytest.mark.parametrize("data_loader, exp_keys", [
+        # single csv with header and grouping mapping
+    (
+        CsvLoader(path=datafolder + "dataxy_with_header.csv", var_dict={"a": [0, 1]}, num_parallel_calls=2,
+                  prefetch_buffer_size=2),
+        ["a"]
+    ),
+        # multiple csv files with header read in parallel
+    (
+        CsvLoader(path=[datafolder + "dataxy_with_header.csv"]*4, num_parallel_reads=4),
+        ["x", "y"]
+    ),
+        # sample dict
+    (
+        SampleDictLoader({"x": np.random.rand(1000, 2)}, num_parallel_calls=2, prefetch_buffer_size=2),
+        ["x"]
+    ),
+])
+def test_mapped_batches(data_loader, exp_keys):
+    batch = dict(data_loader.to_mapped_tfdataset(batch_size=50).make_one_shot_iterator().get_next())
+    assert set(batch.keys()) == set(exp_keys)
+    assert np.all([v.shape.as_list()[0] == 50 for v in batch.values()])
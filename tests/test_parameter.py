@@ -1,3 +1,4 @@
+import tensorflow as tf
 import inferpy as inf
 
 
@@ -24,3 +25,13 @@ def test_parameter_in_datamodel():
 def test_run_in_session():
     x = inf.Parameter(0)
     assert inf.get_session().run(x) == 0
+
+
+def test_float16_master_weights():
+    with inf.util.floatx_scope('float16'):
+        p = inf.Parameter(1., name='p16')
+
+    # the tf.Variable is kept in float32, but the value of the parameter is float16
+    assert p.var.dtype.base_dtype == tf.float32
+    assert tf.convert_to_tensor(p).dtype == tf.float16
+    assert inf.util.floatx() == 'float32'
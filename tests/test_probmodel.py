@@ -1,9 +1,10 @@
 import numpy as np
 import pytest
+import tensorflow as tf
 
 import inferpy as inf
 from inferpy import util
-from tests import no_raised_exc
+from tests import no_raised_exc, normal_model, normal_qmodel
 
 
 def test_build_model():
@@ -155,3 +156,167 @@ def test_log_prob():
 
     # assert that the result of sum_log_prob is a single float32 number
     assert isinstance(m.prior(data=data).sum_log_prob(), np.float32)
+
+
+def test_partial_fit():
+    N = 50
+    m = normal_model()
+
+    # partial_fit cannot be used before fit
+    with pytest.raises(RuntimeError):
+        m.partial_fit({'x': np.ones(N)})
+
+    vi = inf.inference.VI(normal_qmodel(), epochs=10)
+    m.fit({'x': np.ones(N)}, vi)
+    train_tensor = vi.train_tensor
+
+    m.partial_fit({'x': np.zeros(N)})
+    # the compiled train tensor is reused, and the losses of both updates are stored
+    assert vi.train_tensor is train_tensor
+    assert len(vi.losses) == 20
+
+    # the data must have the same plate size
+    with pytest.raises(ValueError):
+        m.partial_fit({'x': np.ones(2 * N)})
+
+
+@pytest.mark.parametrize("direct_input", [False, True])
+def test_partial_fit_svi(direct_input):
+    m = normal_model()
+    svi = inf.inference.SVI(normal_qmodel(), epochs=10, batch_size=10, direct_input=direct_input)
+    m.fit({'x': np.ones(50)}, svi)
+    assert inf.get_session().run(svi.batch_weight) == 5
+
+    # the batch_weight is computed for the size of the data used in each update
+    m.partial_fit({'x': np.ones(100)})
+    assert inf.get_session().run(svi.batch_weight) == 10
+    assert svi.batches == 10
+    assert np.all(np.isfinite(svi.losses))
+
+
+@pytest.mark.parametrize("inference_method", [
+    lambda q: inf.inference.VI(q, epochs=10, dynamic_plate=True),
+    lambda q: inf.inference.SVI(q, epochs=10, batch_size=20, dynamic_plate=True),
+    lambda q: inf.inference.SVI(q, epochs=10, batch_size=20, direct_input=True, dynamic_plate=True),
+])
+def test_dynamic_plate(inference_method):
+    m = normal_model()
+    method = inference_method(normal_qmodel())
+    m.fit({'x': np.ones(50)}, method)
+    train_tensor = method.train_tensor
+
+    # the same train tensor is used with data of a different size, including the ragged last batch
+    m.partial_fit({'x': np.ones(75)})
+    assert method.train_tensor is train_tensor
+    assert np.all(np.isfinite(method.losses))
+
+
+@pytest.mark.parametrize("inference_method", [
+    lambda q: inf.inference.VI(q, epochs=10, mixed_precision=True),
+    lambda q: inf.inference.VI(q, epochs=10, steps_per_loop=5, mixed_precision=True),
+    lambda q: inf.inference.SVI(q, epochs=10, batch_size=10, direct_input=True, mixed_precision=True),
+])
+def test_mixed_precision(inference_method):
+    m = normal_model()
+    method = inference_method(normal_qmodel())
+    m.fit({'x': np.ones(50)}, method)
+
+    # the expanded model is computed in float16, the parameters are kept in float32 and the loss is float32
+    assert method.expanded_variables['q']['mu'].dtype == tf.float16
+    assert method.expanded_parameters['q']['qmu_loc'].var.dtype.base_dtype == tf.float32
+    assert method.debug.loss_tensor.dtype == tf.float32
+    assert np.all(np.isfinite(method.losses))
+
+    # the loss scale is updated in every step, also inside the train loop
+    loss_scale, finite_steps = inf.get_session().run(method._loss_scale_variables)
+    assert finite_steps > 0 or loss_scale < 2. ** 15
+
+
+def test_warm_start(tmp_path):
+    m = normal_model()
+    vi = inf.inference.VI(normal_qmodel(), epochs=100)
+    m.fit({'x': np.ones(50)}, vi)
+    snapshot = vi.get_snapshot()
+    assert set(snapshot.keys()) == {'qmu_loc:0', 'qmu_scale:0'}
+    vi.save_snapshot(str(tmp_path / 'snapshot.npz'))
+
+    # the variables are initialized from the previous fit, from the snapshot or from the saved file
+    for warm_start in [vi, snapshot, str(tmp_path / 'snapshot.npz')]:
+        warm_vi = inf.inference.VI(normal_qmodel(), epochs=0, warm_start=warm_start)
+        m.fit({'x': np.ones(50)}, warm_vi)
+        assert np.allclose(warm_vi.get_snapshot()['qmu_loc:0'], snapshot['qmu_loc:0'])
+        # compiling a new inference object does not initialize the variables of the previous one again
+        assert np.allclose(vi.get_snapshot()['qmu_loc:0'], snapshot['qmu_loc:0'])
+
+
+class InterruptCallback(inf.inference.Callback):
+    """ Records the snapshot of the inference method at the end of an epoch, and raises an exception at the end of
+        another one to simulate the interruption of the process """
+    def __init__(self, snapshot_epoch, interrupt_epoch):
+        super().__init__()
+        self.inference_method = None
+        self.snapshot_epoch = snapshot_epoch
+        self.interrupt_epoch = interrupt_epoch
+        self.snapshot = None
+        self.epochs = []
+
+    def on_epoch_end(self, epoch, logs):
+        self.epochs.append(epoch)
+        if epoch == self.snapshot_epoch:
+            self.snapshot = self.inference_method.get_snapshot()
+        if epoch == self.interrupt_epoch:
+            raise InterruptedError()
+
+
+def test_checkpoint_resume(tmp_path):
+    path = str(tmp_path / 'checkpoint')
+
+    # the process is interrupted after 7 epochs, and the last checkpoint is saved after 5 epochs
+    callback = InterruptCallback(snapshot_epoch=4, interrupt_epoch=6)
+    vi = inf.inference.VI(normal_qmodel(), epochs=10, checkpoint_path=path, checkpoint_interval=5,
+                          callbacks=[callback], verbose=False)
+    callback.inference_method = vi
+    with pytest.raises(InterruptedError):
+        normal_model().fit({'x': np.ones(50)}, vi)
+
+    # the model is built again in a new graph, and the checkpoint is restored when it is compiled
+    with tf.Graph().as_default(), tf.Session() as sess:
+        inf.set_session(sess)
+        restored_vi = inf.inference.VI(normal_qmodel(), epochs=5, verbose=False)
+        restored_vi.restore_checkpoint(path)
+        normal_model().fit({'x': np.ones(50)}, restored_vi)
+
+        # there are no epochs left to run, so the state is the one saved in the checkpoint
+        assert restored_vi.current_epoch == 5
+        assert len(restored_vi.losses) == 5
+        snapshot = restored_vi.get_snapshot()
+        for key, value in callback.snapshot.items():
+            assert np.allclose(snapshot[key], value)
+
+    # the process resumes from the epoch where the checkpoint was saved
+    with tf.Graph().as_default(), tf.Session() as sess:
+        inf.set_session(sess)
+        resumed_callback = InterruptCallback(snapshot_epoch=None, interrupt_epoch=None)
+        resumed_vi = inf.inference.VI(normal_qmodel(), epochs=10, callbacks=[resumed_callback], verbose=False)
+        resumed_vi.restore_checkpoint(path)
+        normal_model().fit({'x': np.ones(50)}, resumed_vi)
+
+        assert resumed_callback.epochs == list(range(5, 10))
+        assert resumed_vi.current_epoch == 10
+        assert len(resumed_vi.losses) == 10
+
+
+@pytest.mark.parametrize("steps_per_loop", [None, 4])
+def test_loss_record_interval(steps_per_loop):
+    epochs, interval = 10, 3
+    vi = inf.inference.VI(normal_qmodel(), epochs=epochs, loss_record_interval=interval, steps_per_loop=steps_per_loop,
+                          verbose=False)
+    normal_model().fit({'x': np.ones(50)}, vi)
+
+    # the loss is stored in the epochs 0, 3, 6 and 9, which are the same losses of the metrics buffer
+    recorded_epochs = list(range(0, epochs, interval))
+    assert len(vi.losses) == int(np.ceil(epochs / interval))
+    assert np.allclose(vi.losses, vi.metrics.loss[recorded_epochs])
+    if steps_per_loop is None:
+        # outside the train loop, the loss of the rest of epochs is not fetched
+        assert np.all(np.isnan(np.delete(vi.metrics.loss, recorded_epochs)))